@@ -1,5 +1,6 @@
 import os
-from flask import Flask, session, url_for, redirect, abort
+import hmac
+from flask import Flask, session, url_for, redirect, abort, request, current_app
 from flask_sqlalchemy import SQLAlchemy
 from config import Config
 from authlib.integrations.flask_client import OAuth
@@ -8,10 +9,11 @@ from sqlalchemy import create_engine, text
 from urllib.parse import urlparse
 import logging
 from flask_migrate import Migrate
+from app.routing import RoutingSession, remember_write_position
 
 
-# Initialize SQLAlchemy
-db = SQLAlchemy()
+# Initialize SQLAlchemy; reads may be routed to the optional 'replica' bind
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 oauth = OAuth()
 
@@ -54,6 +56,21 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def device_token_required(f):
+    """Decorator for edge-device endpoints: a bearer token from EDGE_API_TOKENS, or an admin session."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        auth_header = request.headers.get('Authorization', '')
+        token = auth_header[len('Bearer '):] if auth_header.startswith('Bearer ') else None
+        valid_tokens = current_app.config.get('EDGE_API_TOKENS') or []
+        if token and any(hmac.compare_digest(token.encode(), valid.encode()) for valid in valid_tokens):
+            return f(*args, **kwargs)
+        user_roles = session.get('user', {}).get('http://biocoder.edge.com/roles', [])
+        if 'Admin' in user_roles:
+            return f(*args, **kwargs)
+        abort(401)
+    return decorated_function
+
 
 def create_app():
     """
@@ -97,7 +114,22 @@ def create_app():
     # 6) Register blueprints / routes
     from app.views import main_bp
     app.register_blueprint(main_bp)
-    
+    app.after_request(remember_write_position)
+
+    # 7) Register CLI commands
+    from app.ingest import ingest_command
+    from app.sftp_fetch import sftp_pull_command
+    from app.storage import storage_cli
+    from app.similarity import similarity_cli
+    from app.partitions import partitions_cli
+    from app.retention import retention_cli
+    app.cli.add_command(ingest_command)
+    app.cli.add_command(sftp_pull_command)
+    app.cli.add_command(storage_cli)
+    app.cli.add_command(similarity_cli)
+    app.cli.add_command(partitions_cli)
+    app.cli.add_command(retention_cli)
+
     @app.route('/login')
     def login():
         return auth0.authorize_redirect(redirect_uri=url_for('callback', _external=True))
@@ -0,0 +1,355 @@
+import os
+import json
+import math
+import time
+import uuid
+import fcntl
+import atexit
+import hashlib
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from flask import current_app, session, request, jsonify
+
+# interactive requests are never limited, only measured
+COST_CLASSES = ("interactive", "medium", "heavy")
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+POLL_SECONDS = 0.05
+
+
+class Rejected(Exception):
+    """Raised when a request cannot be admitted; carries what the 429 response needs."""
+
+    def __init__(self, message, retry_after, queue_position=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.queue_position = queue_position
+
+
+def _folder(cost_class=None):
+    root = current_app.config["ADMISSION_FOLDER"]
+    return os.path.join(root, cost_class) if cost_class else root
+
+
+def limits(cost_class):
+    """(global limit, per-user limit) of a cost class; 0 means unlimited."""
+    if cost_class == "interactive":
+        return 0, 0
+    prefix = f"ADMISSION_{cost_class.upper()}"
+    return current_app.config[f"{prefix}_GLOBAL"], current_app.config[f"{prefix}_PER_USER"]
+
+
+def user_key():
+    """
+    The signed-in user, or for anonymous visitors an id kept in their session
+    cookie. Client addresses are not used: behind the proxy they are all the same.
+    """
+    user = session.get("user") or {}
+    identity = user.get("sub") or user.get("email")
+    if not identity:
+        if "admission_id" not in session:
+            session["admission_id"] = uuid.uuid4().hex
+        identity = session["admission_id"]
+    return hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+
+
+def _try_lock(path):
+    """
+    Takes an exclusive flock on a slot file without blocking. flock locks
+    belong to the open file, so they exclude other threads as well as other
+    workers, and the kernel drops them if a worker dies.
+    """
+    f = open(path, "a")
+    try:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+    except BlockingIOError:
+        f.close()
+        return None
+
+
+def _acquire_any(folder, prefix, count):
+    """Locks the first free one of `count` slot files; returns (index, file) or None."""
+    for index in range(count):
+        f = _try_lock(os.path.join(folder, f"{prefix}.{index}.lock"))
+        if f is not None:
+            return index, f
+    return None
+
+
+def _release(slots):
+    for _, f in slots:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        f.close()
+
+
+def _in_flight(folder, prefix, count):
+    """Number of slots currently held, found by probing each one."""
+    busy = 0
+    for index in range(count):
+        f = _try_lock(os.path.join(folder, f"{prefix}.{index}.lock"))
+        if f is None:
+            busy += 1
+        else:
+            _release([(index, f)])
+    return busy
+
+
+class _WorkerGate:
+    """
+    Caps how many of this worker's threads limited requests may occupy,
+    running or waiting, so every worker keeps threads free for search.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._in_use = 0
+
+    def enter(self, capacity):
+        with self._lock:
+            if capacity and self._in_use >= capacity:
+                return False
+            self._in_use += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self._in_use -= 1
+
+
+_gate = _WorkerGate()
+
+
+def _retry_after(cost_class, position):
+    """Seconds until a slot is likely free, from the class's mean service time."""
+    stats = read_metrics().get(cost_class) or {}
+    mean = stats["busy_seconds"] / stats["admitted"] if stats.get("admitted") else current_app.config["ADMISSION_WAIT_SECONDS"]
+    global_limit, _ = limits(cost_class)
+    return max(1, math.ceil(mean * max(position, 1) / max(global_limit, 1)))
+
+
+def acquire(cost_class, key):
+    """
+    Takes a per-user slot and a global slot of the cost class. When either is
+    full the request may wait for up to ADMISSION_WAIT_SECONDS, but only while
+    it holds one of the ADMISSION_MAX_WAITING waiting slots shared by every
+    class; otherwise it is turned away at once. Returns (held slots, seconds
+    waited); raises Rejected.
+    """
+    global_limit, user_limit = limits(cost_class)
+    if not global_limit and not user_limit:
+        return [], 0.0
+
+    folder = _folder(cost_class)
+    os.makedirs(folder, exist_ok=True)
+    max_waiting = current_app.config["ADMISSION_MAX_WAITING"]
+    started = time.monotonic()
+    deadline = started + current_app.config["ADMISSION_WAIT_SECONDS"]
+    waiting_slot = None
+    try:
+        while True:
+            held = []
+            if user_limit:
+                slot = _acquire_any(folder, f"user-{key}", user_limit)
+                if slot is not None:
+                    held.append(slot)
+            if global_limit and (held or not user_limit):
+                slot = _acquire_any(folder, "global", global_limit)
+                if slot is not None:
+                    held.append(slot)
+            if len(held) == bool(user_limit) + bool(global_limit):
+                return held, time.monotonic() - started
+            _release(held)
+
+            if waiting_slot is None:
+                waiting_slot = _acquire_any(_folder(), "waiting", max_waiting)
+                if waiting_slot is None:
+                    raise Rejected("Server is busy", _retry_after(cost_class, max_waiting + 1), max_waiting + 1)
+            position = waiting_slot[0] + 1
+            if time.monotonic() >= deadline:
+                raise Rejected("Server is busy", _retry_after(cost_class, position), position)
+            time.sleep(POLL_SECONDS)
+    finally:
+        if waiting_slot is not None:
+            _release([waiting_slot])
+
+
+def _empty_stats():
+    return {
+        "admitted": 0, "rejected": 0, "queued": 0, "wait_seconds": 0.0,
+        "busy_seconds": 0.0, "max_seconds": 0.0,
+        "latency_buckets": [0] * (len(LATENCY_BUCKETS) + 1),
+    }
+
+
+def _merge(into, delta):
+    for key, value in delta.items():
+        if key == "max_seconds":
+            into[key] = max(into.get(key, 0.0), value)
+        elif key == "latency_buckets":
+            into[key] = [a + b for a, b in zip(into.get(key) or [0] * len(value), value)]
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+@contextmanager
+def _metrics_locked(folder):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "metrics.lock"), "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield os.path.join(folder, "metrics.json")
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _load_metrics(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def read_metrics():
+    return _load_metrics(os.path.join(_folder(), "metrics.json"))
+
+
+class _PendingMetrics:
+    """
+    Counters of this worker not yet written to the shared metrics file.
+    Requests only touch memory; the file is merged into at most every
+    ADMISSION_METRICS_FLUSH_SECONDS, so no request waits on a shared lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+        self._folder = None
+
+    def add(self, cost_class, rejected, waited, duration, folder, interval):
+        with self._lock:
+            if self._folder is None:
+                self._folder = folder
+                atexit.register(self.flush)
+            stats = self._pending.setdefault(cost_class, _empty_stats())
+            if rejected:
+                stats["rejected"] += 1
+            else:
+                stats["admitted"] += 1
+                stats["queued"] += waited > POLL_SECONDS
+                stats["wait_seconds"] += waited
+                stats["busy_seconds"] += duration
+                stats["max_seconds"] = max(stats["max_seconds"], waited + duration)
+                bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if waited + duration <= bound),
+                              len(LATENCY_BUCKETS))
+                stats["latency_buckets"][bucket] += 1
+            due = time.monotonic() - self._flushed_at >= interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            folder = self._folder
+        if not pending or folder is None:
+            return
+        with _metrics_locked(folder) as path:
+            metrics = _load_metrics(path)
+            for cost_class, delta in pending.items():
+                _merge(metrics.setdefault(cost_class, _empty_stats()), delta)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(metrics, f)
+            os.replace(tmp_path, path)
+
+
+_metrics = _PendingMetrics()
+
+
+def record(cost_class, rejected=False, waited=0.0, duration=0.0):
+    """Counts one request; the shared file catches up on the next flush."""
+    try:
+        _metrics.add(cost_class, rejected, waited, duration,
+                     _folder(), current_app.config["ADMISSION_METRICS_FLUSH_SECONDS"])
+    except OSError as e:
+        current_app.logger.error(f"Could not record admission metrics: {e}")
+
+
+def snapshot():
+    """
+    Counters plus current in-flight and waiting requests for every cost
+    class. Other workers' counters may lag by one flush interval.
+    """
+    _metrics.flush()
+    metrics = read_metrics()
+    waiting = _in_flight(_folder(), "waiting", current_app.config["ADMISSION_MAX_WAITING"]) \
+        if os.path.isdir(_folder()) else 0
+    result = {"waiting": waiting}
+    for cost_class in COST_CLASSES:
+        global_limit, user_limit = limits(cost_class)
+        folder = _folder(cost_class)
+        stats = dict(metrics.get(cost_class) or {})
+        stats["global_limit"] = global_limit
+        stats["per_user_limit"] = user_limit
+        stats["latency_bucket_bounds"] = list(LATENCY_BUCKETS)
+        if global_limit and os.path.isdir(folder):
+            stats["in_flight"] = _in_flight(folder, "global", global_limit)
+        result[cost_class] = stats
+    return result
+
+
+def _busy_response(cost_class, e):
+    record(cost_class, rejected=True)
+    current_app.logger.warning(f"Rejected {cost_class} request to {request.path}: {e}")
+    body = {"success": False, "error": str(e), "retry_after": e.retry_after}
+    if e.queue_position is not None:
+        body["queue_position"] = e.queue_position
+    response = jsonify(body)
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+def admission(cost_class):
+    """
+    Decorator that admits a view under the limits of its cost class, or
+    answers 429 with Retry-After and a queue position.
+    """
+    if cost_class not in COST_CLASSES:
+        raise ValueError(f"Unknown cost class {cost_class}")
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if cost_class == "interactive":
+                started = time.monotonic()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    record(cost_class, duration=time.monotonic() - started)
+
+            if not _gate.enter(current_app.config["ADMISSION_WORKER_SLOTS"]):
+                return _busy_response(cost_class, Rejected("Server is busy", _retry_after(cost_class, 1)))
+            try:
+                try:
+                    held, waited = acquire(cost_class, user_key())
+                except Rejected as e:
+                    return _busy_response(cost_class, e)
+                except OSError as e:
+                    # Never take the site down because the lock folder is unusable
+                    current_app.logger.error(f"Admission control unavailable, admitting request: {e}")
+                    return f(*args, **kwargs)
+
+                started = time.monotonic()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    _release(held)
+                    record(cost_class, waited=waited, duration=time.monotonic() - started)
+            finally:
+                _gate.leave()
+        return decorated_function
+    return decorator
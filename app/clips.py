@@ -0,0 +1,71 @@
+import os
+import uuid
+from flask import current_app
+from app.media import run_ffmpeg
+from app.storage import FileStore
+from app.retention import readable_video
+
+
+def clip_path(event_id, start, end):
+    key = f"{event_id}_{start:.3f}_{end:.3f}"
+    return os.path.join(current_app.config["CLIP_CACHE_FOLDER"], FileStore.shard(key), f"{key}.mp4")
+
+
+def evict(max_bytes):
+    """Deletes the least recently used clips until the cache fits in max_bytes."""
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(current_app.config["CLIP_CACHE_FOLDER"]):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def get_clip(event_id, start, end, evict_cache=True):
+    """
+    Returns the path of an MP4 holding [start, end] of the event's video.
+    The clip is cut with a stream copy from the keyframe at or before
+    start, so no re-encode happens. It is cached on disk, and each hit
+    refreshes its mtime for LRU eviction. Callers cutting many clips pass
+    evict_cache=False and call evict once at the end. Returns None if the
+    video is missing; raises RuntimeError if ffmpeg fails.
+    """
+    target = clip_path(event_id, start, end)
+    if os.path.exists(target):
+        os.utime(target)
+        return target
+
+    # Cut straight from the cold tier if need be; a few seconds never justify restoring the whole video
+    source = readable_video(event_id)
+    if source is None:
+        return None
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+    try:
+        run_ffmpeg(["-ss", f"{start:.3f}", "-i", source, "-t", f"{end - start:.3f}",
+                    "-map", "0", "-c", "copy", "-avoid_negative_ts", "make_zero",
+                    "-movflags", "+faststart", "-f", "mp4", tmp_path])
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    if evict_cache:
+        evict(current_app.config["CLIP_CACHE_MAX_BYTES"])
+    return target
@@ -0,0 +1,115 @@
+import os
+import threading
+from datetime import datetime
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy.dialects.postgresql import insert
+from app import db, media, stats, similarity, occupancy
+from app.models import Event, IngestedEvent
+from app.storage import get_store
+
+
+def ingest_event(event_id, update_similarity=True):
+    """
+    Runs the ingest-time processing stages for one event whose files have
+    landed in the WATCH_FOLDER. Every stage is safe to re-run. Callers
+    processing many events pass update_similarity=False and write the
+    signatures in one batch afterwards.
+    """
+    event = Event.lookup(event_id)
+    if not event:
+        current_app.logger.warning(f"Ingest skipped, no event record for {event_id}.")
+        return False
+
+    store = get_store()
+    if store.exists(event_id):
+        try:
+            media.process_video(event_id, store)
+        except Exception as e:
+            current_app.logger.error(f"Media processing failed for {event_id}: {e}")
+
+    # Archived events were fully processed before retention cut their JSON
+    # down to a summary; recomputing from the summary would erase their stats.
+    if event.detections is not None and event.detections.json_archived:
+        current_app.logger.info(f"Skipping statistics and occupancy for archived event {event_id}.")
+    else:
+        try:
+            stats.update_event_stats(event)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Computing class statistics failed for {event_id}: {e}")
+
+        try:
+            occupancy.accumulate_event(event)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            current_app.logger.error(f"Updating occupancy grids failed for {event_id}: {e}")
+
+    if update_similarity:
+        try:
+            similarity.update_event(event)
+        except Exception as e:
+            current_app.logger.error(f"Updating the similarity signature failed for {event_id}: {e}")
+
+    try:
+        now = datetime.utcnow()
+        db.session.execute(
+            insert(IngestedEvent.__table__)
+            .values(event_id=event_id, ingested_at=now)
+            .on_conflict_do_update(index_elements=["event_id"], set_={"ingested_at": now})
+        )
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Recording ingest of {event_id} failed: {e}")
+
+    return True
+
+
+def pending_events():
+    """
+    Ids of events with a stored video or JSON file that changed since the
+    event was last ingested, or that was never ingested.
+    """
+    store = get_store()
+    rows = (db.session.query(Event.event_id, IngestedEvent.ingested_at)
+            .outerjoin(IngestedEvent, IngestedEvent.event_id == Event.event_id)
+            .order_by(Event.event_id))
+    pending = []
+    for event_id, ingested_at in rows:
+        paths = [store.path(event_id, kind) for kind in ("video", "json")]
+        mtimes = [os.path.getmtime(path) for path in paths if path is not None]
+        if mtimes and (ingested_at is None or datetime.utcfromtimestamp(max(mtimes)) > ingested_at):
+            pending.append(event_id)
+    return pending
+
+
+def ingest_in_background(event_id):
+    """Runs ingest_event on a daemon thread so a request can return immediately."""
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            ingest_event(event_id)
+
+    threading.Thread(target=run, name=f"ingest-{event_id}", daemon=True).start()
+
+
+@click.command("ingest")
+@click.argument("event_ids", nargs=-1)
+@click.option("--all", "all_events", is_flag=True, help="Reprocess every event, not only those with new files.")
+@with_appcontext
+def ingest_command(event_ids, all_events):
+    """Process the given events, or those whose files arrived or changed since they were last processed."""
+    if all_events:
+        event_ids = [row[0] for row in db.session.query(Event.event_id).order_by(Event.event_id)]
+    elif not event_ids:
+        event_ids = pending_events()
+
+    processed = [event_id for event_id in event_ids if ingest_event(event_id, update_similarity=False)]
+    # One pass over the signature matrix instead of a row scan per event
+    similarity.update_event_ids(processed)
+    click.echo(f"Processed {len(processed)} of {len(event_ids)} events.")
@@ -0,0 +1,180 @@
+import os
+import shutil
+import struct
+import subprocess
+from flask import current_app
+from app.storage import FileStore
+
+
+def _ffmpeg():
+    return current_app.config.get("FFMPEG_BINARY") or shutil.which("ffmpeg") or "ffmpeg"
+
+
+def run_ffmpeg(args):
+    """Runs ffmpeg quietly and raises with its stderr if it fails."""
+    cmd = [_ffmpeg(), "-hide_banner", "-loglevel", "error", "-y"] + args
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({result.returncode}): {result.stderr.decode(errors='replace').strip()}")
+
+
+def probe_frame_size(video_path):
+    """(width, height) of the first video stream, or None if ffprobe cannot tell."""
+    ffprobe = current_app.config.get("FFPROBE_BINARY") or shutil.which("ffprobe") or "ffprobe"
+    cmd = [ffprobe, "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "stream=width,height", "-of", "csv=p=0:s=x", video_path]
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+    except (OSError, subprocess.TimeoutExpired) as e:
+        current_app.logger.warning(f"ffprobe could not run on {video_path}: {e}")
+        return None
+    try:
+        width, height = result.stdout.decode().strip().splitlines()[0].split("x")[:2]
+        return float(width), float(height)
+    except (IndexError, ValueError):
+        return None
+
+
+def top_level_atoms(video_path):
+    """
+    Yields (atom_type, offset, size) for the top-level boxes of an MP4 file
+    by reading only the box headers, never the media data.
+    """
+    file_size = os.path.getsize(video_path)
+    with open(video_path, "rb") as f:
+        offset = 0
+        while offset + 8 <= file_size:
+            f.seek(offset)
+            header = f.read(8)
+            size, atom_type = struct.unpack(">I4s", header)
+            if size == 1:
+                # 64-bit "largesize" follows the type
+                size = struct.unpack(">Q", f.read(8))[0]
+            elif size == 0:
+                # Box extends to the end of the file
+                size = file_size - offset
+            if size < 8:
+                break
+            yield atom_type.decode("latin-1"), offset, size
+            offset += size
+
+
+def is_faststart(video_path):
+    """True if the moov atom comes before mdat, so playback can begin immediately."""
+    for atom_type, _, _ in top_level_atoms(video_path):
+        if atom_type == "moov":
+            return True
+        if atom_type == "mdat":
+            return False
+    return False
+
+
+def faststart_remux(video_path, publish=None):
+    """
+    Moves the moov atom to the front of the file with a stream copy (no re-encode).
+    The remuxed file is handed to `publish(tmp_path)`, which by default replaces
+    the original atomically. Returns True if a remux happened.
+    """
+    if is_faststart(video_path):
+        return False
+
+    tmp_path = f"{video_path}.faststart.tmp"
+    try:
+        run_ffmpeg(["-i", video_path, "-map", "0", "-c", "copy",
+                    "-movflags", "+faststart", "-f", "mp4", tmp_path])
+        if publish is None:
+            os.replace(tmp_path, video_path)
+        else:
+            publish(tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def renditions_dir(event_id):
+    """Per-event renditions folder, sharded like the videos; the old flat folder is still read."""
+    root = current_app.config["RENDITIONS_FOLDER"]
+    flat = os.path.join(root, event_id)
+    if not current_app.config["STORAGE_SHARDED"]:
+        return flat
+    sharded = os.path.join(root, FileStore.shard(event_id), event_id)
+    if not os.path.exists(sharded) and os.path.exists(flat):
+        return flat
+    return sharded
+
+
+def hls_playlist_path(event_id):
+    return os.path.join(renditions_dir(event_id), "hls", "index.m3u8")
+
+
+def preview_path(event_id):
+    return os.path.join(renditions_dir(event_id), "preview.mp4")
+
+
+def build_hls(event_id, video_path):
+    """Segments the video into a VOD HLS playlist using a stream copy."""
+    playlist = hls_playlist_path(event_id)
+    if os.path.exists(playlist):
+        return False
+
+    out_dir = os.path.dirname(playlist)
+    tmp_dir = f"{out_dir}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    try:
+        run_ffmpeg(["-i", video_path, "-map", "0:v:0", "-map", "0:a?", "-c", "copy",
+                    "-f", "hls", "-hls_time", str(current_app.config["HLS_SEGMENT_SECONDS"]),
+                    "-hls_playlist_type", "vod",
+                    "-hls_segment_filename", os.path.join(tmp_dir, "seg_%05d.ts"),
+                    os.path.join(tmp_dir, "index.m3u8")])
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.replace(tmp_dir, out_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return True
+
+
+def build_preview(event_id, video_path):
+    """Encodes a small, low-bitrate faststart MP4 used for quick previews."""
+    target = preview_path(event_id)
+    if os.path.exists(target):
+        return False
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f"{target}.tmp"
+    height = current_app.config["PREVIEW_HEIGHT"]
+    bitrate = current_app.config["PREVIEW_BITRATE"]
+    try:
+        run_ffmpeg(["-i", video_path, "-map", "0:v:0", "-an",
+                    "-vf", f"scale=-2:'min({height},ih)'",
+                    "-c:v", "libx264", "-preset", "veryfast",
+                    "-b:v", bitrate, "-maxrate", bitrate, "-bufsize", bitrate,
+                    "-movflags", "+faststart", "-f", "mp4", tmp_path])
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return True
+
+
+def process_video(event_id, store):
+    """
+    Ingest-time media stage: faststart remux, then the optional HLS and
+    preview renditions enabled in the config.
+    """
+    config = current_app.config
+    video_path = store.path(event_id)
+    if video_path is None:
+        return
+    if config["MEDIA_FASTSTART"] and faststart_remux(video_path, publish=lambda tmp: store.store(tmp, event_id)):
+        current_app.logger.info(f"Remuxed {event_id} to faststart.")
+        video_path = store.path(event_id)
+    if config["MEDIA_HLS_ENABLED"] and build_hls(event_id, video_path):
+        current_app.logger.info(f"Built HLS rendition for {event_id}.")
+    if config["MEDIA_PREVIEW_ENABLED"] and build_preview(event_id, video_path):
+        current_app.logger.info(f"Built preview rendition for {event_id}.")
+
+
+def remove_renditions(event_id):
+    shutil.rmtree(renditions_dir(event_id), ignore_errors=True)
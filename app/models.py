@@ -1,5 +1,6 @@
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import func
 from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 
 # Initialize SQLAlchemy (usually done once in your app factory)
@@ -8,11 +9,17 @@ from sqlalchemy.dialects.postgresql import JSONB, ARRAY
 from app import db
 
 class Event(db.Model):
+    """
+    Range-partitioned by month on timestamp_start_utc, so the table key is
+    (event_id, timestamp_start_utc). event_id alone stays unique through
+    event_locator, and the ORM identifies events by event_id only.
+    """
     __tablename__ = 'events'
+    __table_args__ = {'postgresql_partition_by': 'RANGE (timestamp_start_utc)'}
 
     event_id = db.Column(db.String(64), primary_key=True)
     device_id = db.Column(db.String(64), nullable=False)
-    timestamp_start_utc = db.Column(db.DateTime(timezone=False), nullable=False)
+    timestamp_start_utc = db.Column(db.DateTime(timezone=False), primary_key=True, index=True)
     timestamp_end_utc = db.Column(db.DateTime(timezone=False), nullable=False)
     video_duration_seconds = db.Column(db.Float, nullable=False)
     primary_species = db.Column(db.String(64), nullable=False)
@@ -20,29 +27,69 @@ class Event(db.Model):
     remote_video_path = db.Column(db.String(256), nullable=True)
     remote_json_path = db.Column(db.String(256), nullable=True)
 
-    # Relationship to detections
+    # Child tables reference event_locator, so the joins are spelled out
     detections = db.relationship(
         'Detection',
+        primaryjoin='Event.event_id == foreign(Detection.event_id)',
         backref='event',
         cascade='all, delete-orphan',
         lazy='joined',
         uselist=False)
-        
+
     behaviors = db.relationship(
         'Behavior',
+        primaryjoin='Event.event_id == foreign(Behavior.event_id)',
         backref='event',
         cascade='all, delete-orphan',
         lazy='joined',
         order_by='Behavior.start_time_seconds'
     )
 
+    class_stats = db.relationship(
+        'EventClassStat',
+        primaryjoin='Event.event_id == foreign(EventClassStat.event_id)',
+        backref='event',
+        cascade='all, delete-orphan',
+        lazy='select')
+
+    __mapper_args__ = {'primary_key': [event_id]}
+
+    @classmethod
+    def lookup(cls, event_id):
+        """
+        Fetches one event by id. The partition key comes from event_locator
+        in a subquery, so Postgres prunes the scan to a single partition.
+        """
+        partition_key = (
+            db.select(EventLocator.timestamp_start_utc)
+            .where(EventLocator.event_id == event_id)
+            .scalar_subquery()
+        )
+        return cls.query.filter(
+            cls.event_id == event_id,
+            cls.timestamp_start_utc == partition_key
+        ).first()
+
+class EventLocator(db.Model):
+    """
+    One row per event, kept in sync by triggers on events. Gives event_id a
+    global unique key for foreign keys, and maps it to the event's partition.
+    """
+    __tablename__ = 'event_locator'
+
+    event_id = db.Column(db.String(64), primary_key=True)
+    timestamp_start_utc = db.Column(db.DateTime(timezone=False), nullable=False)
+
+    def __repr__(self):
+        return f"<EventLocator {self.event_id} {self.timestamp_start_utc}>"
+
 class Detection(db.Model):
     __tablename__ = 'detections'
 
     id = db.Column(db.Integer, primary_key=True)
     event_id = db.Column(
         db.String(64),
-        db.ForeignKey('events.event_id', ondelete='CASCADE'),
+        db.ForeignKey('event_locator.event_id', ondelete='CASCADE'),
         nullable=False,
         unique = True
     )
@@ -50,15 +97,29 @@ class Detection(db.Model):
     classes_detected = db.Column(ARRAY(db.String(64)), nullable=False)
     classes_modified = db.Column(ARRAY(db.String(64)), nullable=True)
     max_count_per_frame = db.Column(JSONB, nullable=False)
+    # True while the full detection_json lives in detections_archive and only its summary is kept here
+    json_archived = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
 
     def __repr__(self):
         return f"<Detection {self.id} for Event {self.event_id}>"
+
+class DetectionArchive(db.Model):
+    """Full detection_json of events whose hot row was cut down to a summary by retention."""
+    __tablename__ = 'detections_archive'
+
+    event_id = db.Column(db.String(64), db.ForeignKey('event_locator.event_id', ondelete='CASCADE'), primary_key=True)
+    detection_json = db.Column(JSONB, nullable=False)
+    archived_at = db.Column(db.DateTime(timezone=False), nullable=False, default=datetime.utcnow)
+    restored_at = db.Column(db.DateTime(timezone=False), nullable=True)
+
+    def __repr__(self):
+        return f"<DetectionArchive for Event {self.event_id}>"
     
 class Behavior(db.Model):
     __tablename__ = 'behaviors'
     
     id = db.Column(db.Integer, primary_key=True)
-    event_id = db.Column(db.String(64), db.ForeignKey('events.event_id', ondelete='CASCADE'), nullable=False)
+    event_id = db.Column(db.String(64), db.ForeignKey('event_locator.event_id', ondelete='CASCADE'), nullable=False)
     start_time_seconds = db.Column(db.Float, nullable=False)
     end_time_seconds = db.Column(db.Float, nullable=False)
     behavior_description = db.Column(db.Text, nullable=False)
@@ -74,4 +135,71 @@ class BehaviorChoice(db.Model):
     name = db.Column(db.String(100), unique = True, nullable = False)
     
     def __repr__(self):
-        return f"<BehaviorChoice {self.name}>"
\ No newline at end of file
+        return f"<BehaviorChoice {self.name}>"
+
+class EventClassStat(db.Model):
+    __tablename__ = 'event_class_stats'
+
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(64), db.ForeignKey('event_locator.event_id', ondelete='CASCADE'), nullable=False)
+    class_name = db.Column(db.String(64), nullable=False)
+    max_count = db.Column(db.Integer, nullable=False)
+    frames_present = db.Column(db.Integer, nullable=False)
+    # NULL when the event's frame rate is unknown
+    dwell_seconds = db.Column(db.Float, nullable=True)
+    mean_confidence = db.Column(db.Float, nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('event_id', 'class_name', name='uq_event_class_stats_event_class'),
+    )
+
+    def __repr__(self):
+        return f"<EventClassStat {self.class_name} x{self.max_count} for Event {self.event_id}>"
+
+
+# Case-insensitive class lookups with a count or dwell threshold are index range scans
+db.Index('ix_event_class_stats_class_max_count', func.lower(EventClassStat.class_name), EventClassStat.max_count)
+db.Index('ix_event_class_stats_class_dwell', func.lower(EventClassStat.class_name), EventClassStat.dwell_seconds)
+
+
+class OccupancyGrid(db.Model):
+    """Per device, class and month: how often each cell of the camera frame was covered by a bounding box."""
+    __tablename__ = 'occupancy_grids'
+
+    id = db.Column(db.Integer, primary_key=True)
+    device_id = db.Column(db.String(64), nullable=False)
+    class_name = db.Column(db.String(64), nullable=False)
+    month = db.Column(db.Date, nullable=False)
+    grid = db.Column(db.LargeBinary, nullable=False)
+    event_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('device_id', 'class_name', 'month', name='uq_occupancy_grids_device_class_month'),
+    )
+
+    def __repr__(self):
+        return f"<OccupancyGrid {self.device_id} {self.class_name} {self.month}>"
+
+
+class OccupancyEvent(db.Model):
+    """Events already added to the occupancy grids, so re-ingesting never double counts."""
+    __tablename__ = 'occupancy_events'
+
+    event_id = db.Column(db.String(64), db.ForeignKey('event_locator.event_id', ondelete='CASCADE'), primary_key=True)
+    # Frame size the pixel boxes were scaled by, so removal subtracts exactly what was added
+    frame_width = db.Column(db.Float, nullable=True)
+    frame_height = db.Column(db.Float, nullable=True)
+
+    def __repr__(self):
+        return f"<OccupancyEvent {self.event_id}>"
+
+
+class IngestedEvent(db.Model):
+    """When each event last went through the ingest stages, so `flask ingest` only picks up new files."""
+    __tablename__ = 'ingested_events'
+
+    event_id = db.Column(db.String(64), db.ForeignKey('event_locator.event_id', ondelete='CASCADE'), primary_key=True)
+    ingested_at = db.Column(db.DateTime(timezone=False), nullable=False)
+
+    def __repr__(self):
+        return f"<IngestedEvent {self.event_id} {self.ingested_at}>"
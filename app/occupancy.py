@@ -0,0 +1,182 @@
+import zlib
+from datetime import date, datetime
+import numpy as np
+from flask import current_app
+from sqlalchemy.dialects.postgresql import insert
+from app import db, media
+from app.models import Event, OccupancyGrid, OccupancyEvent
+from app.stats import frame_detections
+from app.storage import get_store
+
+GRID_SIZE = 64
+GRID_DTYPE = np.dtype("<u4")
+
+
+def encode_grid(grid):
+    return zlib.compress(grid.astype(GRID_DTYPE).tobytes(), 6)
+
+
+def decode_grid(blob):
+    return np.frombuffer(zlib.decompress(blob), dtype=GRID_DTYPE).reshape(GRID_SIZE, GRID_SIZE).astype(np.int64)
+
+
+def _frame_size(detection_json):
+    """(width, height) of the source frames, if the JSON records them."""
+    width = detection_json.get("frame_width") or detection_json.get("width")
+    height = detection_json.get("frame_height") or detection_json.get("height")
+    resolution = detection_json.get("resolution")
+    if (not width or not height) and isinstance(resolution, (list, tuple)) and len(resolution) == 2:
+        width, height = resolution
+    if width and height:
+        return float(width), float(height)
+    return None
+
+
+def _box_to_xyxy(box):
+    if isinstance(box, dict):
+        if {"x1", "y1", "x2", "y2"} <= box.keys():
+            return box["x1"], box["y1"], box["x2"], box["y2"]
+        if {"x", "y", "w", "h"} <= box.keys():
+            return box["x"], box["y"], box["x"] + box["w"], box["y"] + box["h"]
+        return None
+    if isinstance(box, (list, tuple)) and len(box) == 4:
+        return box
+    return None
+
+
+def event_grids(detection_json, frame_size=None):
+    """
+    Rasterises every bounding box of an event onto a GRID_SIZE x GRID_SIZE
+    grid per class. Each cell counts the boxes that covered it. Boxes are
+    read as normalised [0, 1] coordinates; pixel boxes are scaled by
+    frame_size, and skipped when it is unknown. Returns (grids, skipped).
+    """
+    _, class_names, _, boxes = frame_detections(detection_json)
+    rows = [(name, _box_to_xyxy(box)) for name, box in zip(class_names, boxes)]
+    rows = [(name, xyxy) for name, xyxy in rows if xyxy is not None]
+    if not rows:
+        return {}, 0
+
+    names = np.array([name for name, _ in rows])
+    coords = np.array([xyxy for _, xyxy in rows], dtype=np.float64)
+    in_pixels = coords.max(axis=1) > 1.0
+    skipped = 0
+    if frame_size is not None:
+        coords[in_pixels] /= np.array([frame_size[0], frame_size[1], frame_size[0], frame_size[1]])
+    elif in_pixels.any():
+        # Clamping them would pile every box into the bottom-right cell
+        skipped = int(in_pixels.sum())
+        names, coords = names[~in_pixels], coords[~in_pixels]
+        if not len(names):
+            return {}, skipped
+    coords = np.clip(coords, 0.0, 1.0)
+
+    # Half-open cell ranges [x1, x2) x [y1, y2) covered by each box, at least one cell wide
+    x1 = np.minimum((coords[:, 0] * GRID_SIZE).astype(int), GRID_SIZE - 1)
+    y1 = np.minimum((coords[:, 1] * GRID_SIZE).astype(int), GRID_SIZE - 1)
+    x2 = np.maximum(np.minimum(np.ceil(coords[:, 2] * GRID_SIZE).astype(int), GRID_SIZE), x1 + 1)
+    y2 = np.maximum(np.minimum(np.ceil(coords[:, 3] * GRID_SIZE).astype(int), GRID_SIZE), y1 + 1)
+
+    grids = {}
+    for class_name in np.unique(names):
+        mask = names == class_name
+        # 2D difference array: +1/-1 at the box corners, then a cumulative sum over both axes
+        diff = np.zeros((GRID_SIZE + 1, GRID_SIZE + 1), dtype=np.int64)
+        np.add.at(diff, (y1[mask], x1[mask]), 1)
+        np.add.at(diff, (y1[mask], x2[mask]), -1)
+        np.add.at(diff, (y2[mask], x1[mask]), -1)
+        np.add.at(diff, (y2[mask], x2[mask]), 1)
+        grids[str(class_name)] = diff.cumsum(axis=0).cumsum(axis=1)[:GRID_SIZE, :GRID_SIZE]
+    return grids, skipped
+
+
+def _probe_frame_size(event):
+    """Frame size of the event's stored video, for JSON that does not record it."""
+    video_path = get_store().path(event.event_id, "video")
+    if video_path is None:
+        return None
+    return media.probe_frame_size(video_path)
+
+
+def _apply(event, sign, grids):
+    month = date(event.timestamp_start_utc.year, event.timestamp_start_utc.month, 1)
+    for class_name, grid in grids.items():
+        # Make sure the row exists, then lock it for the read-modify-write
+        db.session.execute(
+            insert(OccupancyGrid.__table__)
+            .values(device_id=event.device_id, class_name=class_name, month=month,
+                    grid=encode_grid(np.zeros((GRID_SIZE, GRID_SIZE))), event_count=0)
+            .on_conflict_do_nothing(constraint='uq_occupancy_grids_device_class_month')
+        )
+        row = OccupancyGrid.query.filter_by(
+            device_id=event.device_id, class_name=class_name, month=month
+        ).with_for_update().one()
+        row.grid = encode_grid(np.maximum(decode_grid(row.grid) + sign * grid, 0))
+        row.event_count = max(row.event_count + sign, 0)
+    return len(grids)
+
+
+def accumulate_event(event):
+    """Adds an event's boxes to its device's monthly grids, once. Caller commits."""
+    if not event.detections or OccupancyEvent.query.get(event.event_id):
+        return 0
+    frame_size = _frame_size(event.detections.detection_json) or _probe_frame_size(event)
+    grids, skipped = event_grids(event.detections.detection_json, frame_size)
+    if skipped:
+        # Usually the JSON arrived before the MP4; the video's ingest retries the event
+        current_app.logger.warning(
+            f"Occupancy for {event.event_id} deferred, {skipped} pixel-space boxes and no frame size yet.")
+        return 0
+    db.session.add(OccupancyEvent(
+        event_id=event.event_id,
+        frame_width=frame_size[0] if frame_size else None,
+        frame_height=frame_size[1] if frame_size else None
+    ))
+    return _apply(event, 1, grids)
+
+
+def remove_event(event):
+    """Subtracts a previously accumulated event from the grids. Caller commits."""
+    accumulated = OccupancyEvent.query.get(event.event_id) if event.detections else None
+    if accumulated is None:
+        return 0
+    # The video may already be gone, so reuse the size the boxes were added with
+    frame_size = (accumulated.frame_width, accumulated.frame_height) if accumulated.frame_width else None
+    grids, _ = event_grids(event.detections.detection_json, frame_size)
+    return _apply(event, -1, grids)
+
+
+def _next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def query_grid(device_id, class_name=None, start_month=None, end_month=None):
+    """
+    Sums the stored monthly grids for a device, optionally per class and
+    month range. Returns (grid, number of events).
+    """
+    q = OccupancyGrid.query.filter(OccupancyGrid.device_id == device_id)
+    if class_name:
+        q = q.filter(db.func.lower(OccupancyGrid.class_name) == class_name.lower())
+    if start_month:
+        q = q.filter(OccupancyGrid.month >= start_month)
+    if end_month:
+        q = q.filter(OccupancyGrid.month <= end_month)
+
+    total = np.zeros((GRID_SIZE, GRID_SIZE), dtype=np.int64)
+    event_count = 0
+    for row in q.all():
+        total += decode_grid(row.grid)
+        event_count += row.event_count
+
+    if not class_name:
+        # Per-class rows count an event once per class it contains
+        events = (db.session.query(db.func.count(OccupancyEvent.event_id))
+                  .join(Event, Event.event_id == OccupancyEvent.event_id)
+                  .filter(Event.device_id == device_id))
+        if start_month:
+            events = events.filter(Event.timestamp_start_utc >= datetime.combine(start_month, datetime.min.time()))
+        if end_month:
+            events = events.filter(Event.timestamp_start_utc < datetime.combine(_next_month(end_month), datetime.min.time()))
+        event_count = events.scalar()
+    return total, event_count
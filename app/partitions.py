@@ -0,0 +1,161 @@
+from datetime import date, datetime
+import click
+from flask.cli import with_appcontext, AppGroup
+from sqlalchemy import text
+from app import db
+
+# Tables whose rows hang off event_locator; detach copies a month's rows of each next to the partition
+CHILD_TABLES = (
+    "detections", "detections_archive", "behaviors", "event_class_stats", "occupancy_events", "ingested_events"
+)
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"events_y{month.year:04d}m{month.month:02d}"
+
+
+def child_copy_name(month, table):
+    return f"{partition_name(month)}_{table}"
+
+
+def archive_tables(month):
+    """The partition and its child row copies, everything a dump of the month needs."""
+    return [partition_name(month)] + [child_copy_name(month, table) for table in CHILD_TABLES]
+
+
+def parse_month(value):
+    try:
+        return month_start(datetime.strptime(value, "%Y-%m"))
+    except ValueError:
+        raise click.BadParameter("expected YYYY-MM")
+
+
+def create_partitions(months_ahead=3, start=None):
+    """
+    Makes sure a partition exists for every month from `start` (default:
+    this month) to `months_ahead` months ahead. Returns the partition names.
+    """
+    month = month_start(start or date.today())
+    names = []
+    for offset in range(months_ahead + 1):
+        names.append(db.session.execute(
+            text("SELECT events_create_partition(:month)"), {"month": add_months(month, offset)}
+        ).scalar())
+    db.session.commit()
+    return names
+
+
+def attached_partitions():
+    """[(name, row estimate), ...] for the partitions currently attached to events."""
+    rows = db.session.execute(text(
+        "SELECT c.relname, c.reltuples::bigint FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'events'::regclass ORDER BY c.relname"
+    ))
+    return [(name, max(estimate, 0)) for name, estimate in rows]
+
+
+def detach_partition(month):
+    """
+    Detaches one month from events. Its rows stay in a standalone table, and
+    the month's detections, behaviors, stats and archived JSON are copied to
+    tables next to it, so archive_tables(month) can be dumped with pg_dump.
+    Searches and lookups stop seeing the month at once.
+    """
+    name = partition_name(month)
+    db.session.execute(text(f'ALTER TABLE events DETACH PARTITION "{name}"'))
+    for table in CHILD_TABLES:
+        db.session.execute(text(
+            f'CREATE TABLE "{child_copy_name(month, table)}" AS '
+            f'SELECT c.* FROM {table} c WHERE c.event_id IN (SELECT event_id FROM "{name}")'
+        ))
+    db.session.commit()
+    return name
+
+
+def _table_exists(name):
+    return db.session.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar() is not None
+
+
+def drop_detached(month, batch_size=1000):
+    """
+    Drops a detached month and its child row copies. Its locator rows are
+    deleted in small batches, which cascades to the month's detections,
+    behaviors and stats without one long transaction. Refuses to run unless
+    detach made the copies. Returns the number of events removed.
+    """
+    name = partition_name(month)
+    if not _table_exists(name):
+        raise click.ClickException(f"{name} does not exist.")
+    attached = {row[0] for row in attached_partitions()}
+    if name in attached:
+        raise click.ClickException(f"{name} is still attached; detach it first.")
+    missing = [table for table in archive_tables(month) if not _table_exists(table)]
+    if missing:
+        raise click.ClickException(f"{', '.join(missing)} missing; the month's child rows were not copied by detach.")
+
+    removed = 0
+    while True:
+        result = db.session.execute(text(
+            f'DELETE FROM event_locator WHERE event_id IN '
+            f'(SELECT l.event_id FROM event_locator l JOIN "{name}" p USING (event_id) LIMIT :limit)'
+        ), {"limit": batch_size})
+        db.session.commit()
+        removed += result.rowcount
+        if result.rowcount < batch_size:
+            break
+
+    for table in reversed(archive_tables(month)):
+        db.session.execute(text(f'DROP TABLE "{table}"'))
+    db.session.commit()
+    return removed
+
+
+partitions_cli = AppGroup("partitions", help="Manage the monthly partitions of the events table.")
+
+
+@partitions_cli.command("create")
+@click.option("--ahead", type=int, default=3, help="Months to create past the current one.")
+@with_appcontext
+def create_command(ahead):
+    """Create upcoming monthly partitions (run from cron)."""
+    for name in create_partitions(months_ahead=ahead):
+        click.echo(name)
+
+
+@partitions_cli.command("list")
+@with_appcontext
+def list_command():
+    """Show attached partitions and their estimated row counts."""
+    for name, estimate in attached_partitions():
+        click.echo(f"{name}\t~{estimate}")
+
+
+@partitions_cli.command("detach")
+@click.argument("month")
+@with_appcontext
+def detach_command(month):
+    """Detach MONTH (YYYY-MM) from events, keeping its rows in standalone tables."""
+    month = parse_month(month)
+    name = detach_partition(month)
+    tables = " ".join(f"--table={table}" for table in archive_tables(month))
+    click.echo(f"Detached {name}. Archive it with: pg_dump {tables} > {name}.sql")
+
+
+@partitions_cli.command("drop")
+@click.argument("month")
+@click.option("--batch-size", type=int, default=1000)
+@with_appcontext
+def drop_command(month, batch_size):
+    """Delete a detached MONTH (YYYY-MM) and its detections and behaviors."""
+    removed = drop_detached(parse_month(month), batch_size=batch_size)
+    click.echo(f"Removed {removed} events.")
@@ -0,0 +1,228 @@
+import os
+import re
+import errno
+import json
+import time
+import uuid
+import fcntl
+import shutil
+from flask import current_app
+from app.storage import get_store, file_sha256
+
+UPLOAD_KINDS = ("video", "json")
+SAFE_EVENT_ID = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+class UploadError(Exception):
+    """Raised for invalid upload requests; carries the HTTP status to return."""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def sessions_dir():
+    return os.path.join(current_app.config["UPLOAD_FOLDER"], "sessions")
+
+
+def _meta_path(upload_id):
+    return os.path.join(sessions_dir(), f"{upload_id}.json")
+
+
+def _data_path(upload_id):
+    return os.path.join(sessions_dir(), f"{upload_id}.part")
+
+
+def load_session(upload_id):
+    if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+        raise UploadError("Upload not found", 404)
+    try:
+        with open(_meta_path(upload_id), "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise UploadError("Upload not found", 404)
+
+
+def current_offset(upload_id):
+    """The data file only ever grows by appending validated ranges, so its size is the offset."""
+    try:
+        return os.path.getsize(_data_path(upload_id))
+    except FileNotFoundError:
+        return 0
+
+
+def purge_stale_sessions():
+    """
+    Removes sessions that have not received data within UPLOAD_SESSION_TTL_HOURS.
+    A session's files are judged by their latest mtime, the .part file's once
+    data arrives, and are removed together.
+    """
+    folder = sessions_dir()
+    if not os.path.isdir(folder):
+        return
+    cutoff = time.time() - current_app.config["UPLOAD_SESSION_TTL_HOURS"] * 3600
+    sessions = {}
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            mtime = os.path.getmtime(path)
+        except FileNotFoundError:
+            continue
+        upload_id = name.split(".", 1)[0]
+        paths, last_active = sessions.get(upload_id, ([], 0))
+        sessions[upload_id] = (paths + [path], max(last_active, mtime))
+
+    for paths, last_active in sessions.values():
+        if last_active >= cutoff:
+            continue
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def create_session(event_id, kind, size, sha256):
+    if not event_id or not SAFE_EVENT_ID.match(event_id):
+        raise UploadError("Invalid event_id")
+    if kind not in UPLOAD_KINDS:
+        raise UploadError(f"kind must be one of {', '.join(UPLOAD_KINDS)}")
+    if not isinstance(size, int) or size <= 0 or size > current_app.config["MAX_CONTENT_LENGTH"]:
+        raise UploadError("Invalid size")
+    if not sha256 or not re.fullmatch(r"[0-9a-fA-F]{64}", sha256):
+        raise UploadError("sha256 must be a hex digest")
+
+    purge_stale_sessions()
+    os.makedirs(sessions_dir(), exist_ok=True)
+    upload_id = uuid.uuid4().hex
+    session_data = {
+        "upload_id": upload_id,
+        "event_id": event_id,
+        "kind": kind,
+        "size": size,
+        "sha256": sha256.lower(),
+        "created": time.time(),
+    }
+    _write_meta(session_data)
+    open(_data_path(upload_id), "wb").close()
+    return session_data
+
+
+def _write_meta(session_data):
+    meta_path = _meta_path(session_data["upload_id"])
+    tmp_path = meta_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(session_data, f)
+    os.replace(tmp_path, meta_path)
+
+
+def parse_content_range(header, size):
+    match = CONTENT_RANGE.match(header or "")
+    if not match:
+        raise UploadError("Content-Range header must look like 'bytes start-end/total'")
+    start, end, total = (int(g) for g in match.groups())
+    if total != size or start > end or end >= size:
+        raise UploadError("Content-Range does not fit the upload size", 416)
+    return start, end
+
+
+def write_chunk(upload_id, content_range, stream):
+    """
+    Appends one byte range, streamed from the request body straight to disk.
+    The range must start at the current offset; anything else is rejected
+    with the offset the client should resume from.
+    """
+    session_data = load_session(upload_id)
+    if session_data.get("completed"):
+        raise UploadError("Upload is already complete", 409, session_data["size"])
+    start, end = parse_content_range(content_range, session_data["size"])
+    chunk_size = current_app.config["UPLOAD_CHUNK_SIZE"]
+
+    with open(_data_path(upload_id), "ab") as f:
+        try:
+            # One writer per session, across threads and workers
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Another request is writing to this upload", 409, current_offset(upload_id))
+
+        offset = os.fstat(f.fileno()).st_size
+        if start != offset:
+            raise UploadError("Range does not start at the current offset", 409, offset)
+
+        remaining = end - start + 1
+        while remaining > 0:
+            block = stream.read(min(chunk_size, remaining))
+            if not block:
+                break
+            f.write(block)
+            remaining -= len(block)
+        f.flush()
+        os.fsync(f.fileno())
+        return os.fstat(f.fileno()).st_size
+
+
+def _publish(src, event_id, kind, sha256):
+    """Hands the file to the store, staging a copy first if the store is on another filesystem."""
+    store = get_store()
+    try:
+        return store.store(src, event_id, kind, sha256=sha256)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    staging_dir = os.path.join(store.root, ".partial")
+    os.makedirs(staging_dir, exist_ok=True)
+    staged = os.path.join(staging_dir, os.path.basename(src))
+    shutil.copyfile(src, staged)
+    dest = store.store(staged, event_id, kind, sha256=sha256)
+    os.remove(src)
+    return dest
+
+
+def finalize(upload_id):
+    """
+    Verifies the completed upload against its declared size and sha256, then
+    publishes it. The session is marked completed rather than removed, so a
+    client retrying after a timeout gets the same success until the session
+    expires.
+    """
+    session_data = load_session(upload_id)
+    if session_data.get("completed"):
+        return session_data, session_data["dest"]
+
+    data_path = _data_path(upload_id)
+    try:
+        f = open(data_path, "rb")
+    except FileNotFoundError:
+        # Only publishing moves the data file, so a finalize is finishing right now
+        session_data = load_session(upload_id)
+        if session_data.get("completed"):
+            return session_data, session_data["dest"]
+        raise UploadError("Upload is being finalized, retry shortly", 409)
+    with f:
+        try:
+            # Excludes write_chunk and a concurrent finalize of the same session
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Upload is being finalized, retry shortly", 409, current_offset(upload_id))
+
+        # Another finalize may have finished between loading the session and taking the lock
+        session_data = load_session(upload_id)
+        if session_data.get("completed"):
+            return session_data, session_data["dest"]
+
+        offset = os.fstat(f.fileno()).st_size
+        if offset != session_data["size"]:
+            raise UploadError("Upload is incomplete", 409, offset)
+
+        if file_sha256(data_path, current_app.config["UPLOAD_CHUNK_SIZE"]) != session_data["sha256"]:
+            # The bytes on disk are unusable; let the client start over
+            open(data_path, "wb").close()
+            raise UploadError("Checksum mismatch, upload must be restarted", 422, 0)
+
+        dest = _publish(data_path, session_data["event_id"], session_data["kind"], session_data["sha256"])
+        session_data["completed"] = time.time()
+        session_data["dest"] = dest
+        _write_meta(session_data)
+    return session_data, dest
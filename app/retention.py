@@ -0,0 +1,311 @@
+import os
+import gzip
+import json
+import time
+import uuid
+import shutil
+from datetime import datetime, timedelta
+import click
+from sqlalchemy.orm import selectinload, noload
+from flask import current_app
+from flask.cli import with_appcontext, AppGroup
+from app import db, media
+from app.models import Event, DetectionArchive
+from app.storage import FileStore, get_store
+
+# Per-frame data moved out of the hot row; everything else (event_summary, frame size, ...) stays
+BULK_JSON_KEYS = ("frames", "detections")
+
+
+def load_policies(path):
+    """
+    Reads the retention policies, a JSON list of rules such as
+    [{"device_id": "cam-01", "species": "deer", "video_days": 90, "json_days": 30}].
+    device_id and species are optional.
+    """
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def policy_for(event, policies):
+    """
+    (video_days, json_days) for an event; 0 means the item is never archived.
+    Matching rules are layered from least to most specific over the defaults.
+    """
+    video_days = current_app.config["RETENTION_VIDEO_DAYS"]
+    json_days = current_app.config["RETENTION_JSON_DAYS"]
+    matching = [
+        rule for rule in policies
+        if (not rule.get("device_id") or rule["device_id"] == event.device_id)
+        and (not rule.get("species") or rule["species"].lower() == (event.primary_species or "").lower())
+    ]
+    for rule in sorted(matching, key=lambda r: bool(r.get("device_id")) + bool(r.get("species"))):
+        video_days = rule.get("video_days", video_days)
+        json_days = rule.get("json_days", json_days)
+    return video_days, json_days
+
+
+def cold_store():
+    return FileStore(current_app.config["COLD_STORAGE_FOLDER"], sharded=True)
+
+
+def cold_path(event_id, kind="video"):
+    """Videos are kept as they are (H.264 does not compress further); JSON is gzipped."""
+    path = cold_store().sharded_path(event_id, kind)
+    return f"{path}.gz" if kind == "json" else path
+
+
+def is_archived(event_id, kind="video"):
+    return os.path.exists(cold_path(event_id, kind))
+
+
+def _copy_file(src, dest, compress=False, decompress=False):
+    """Copies src to dest through a temporary file, so dest is either complete or absent."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    tmp_path = f"{dest}.{uuid.uuid4().hex}.tmp"
+    try:
+        reader = gzip.open(src, "rb") if decompress else open(src, "rb")
+        writer = gzip.open(tmp_path, "wb", compresslevel=6) if compress else open(tmp_path, "wb")
+        with reader as fin, writer as fout:
+            shutil.copyfileobj(fin, fout, 1024 * 1024)
+        with open(tmp_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, dest)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _older_than(path, days):
+    return os.path.getmtime(path) < time.time() - days * 86400
+
+
+def archive_video(event_id, store):
+    """Moves an event's MP4 and drops its renditions. Returns True if anything moved."""
+    src = store.path(event_id, "video")
+    if src is None:
+        return False
+    dest = cold_path(event_id, "video")
+    # A cold copy left by an earlier restore is still valid
+    if not os.path.exists(dest):
+        _copy_file(src, dest)
+    store.delete(event_id, kinds=("video",))
+    media.remove_renditions(event_id)
+    return True
+
+
+def archive_json_file(event_id, store):
+    src = store.path(event_id, "json")
+    if src is None:
+        return False
+    # Always rewritten, the hot file may have been edited since it was restored
+    _copy_file(src, cold_path(event_id, "json"), compress=True)
+    store.delete(event_id, kinds=("json",))
+    return True
+
+
+def archive_detections(detection):
+    """Moves the full detection_json to detections_archive, leaving a summary. Caller commits."""
+    if detection is None or detection.json_archived:
+        return False
+    archived = DetectionArchive.query.get(detection.event_id)
+    if archived is None:
+        archived = DetectionArchive(event_id=detection.event_id)
+        db.session.add(archived)
+    archived.detection_json = detection.detection_json
+    archived.archived_at = datetime.utcnow()
+    archived.restored_at = None
+
+    summary = {k: v for k, v in (detection.detection_json or {}).items() if k not in BULK_JSON_KEYS}
+    detection.detection_json = summary
+    detection.json_archived = True
+    return True
+
+
+def _staging_path(store, suffix):
+    staging_dir = os.path.join(store.root, ".partial")
+    return os.path.join(staging_dir, f"{uuid.uuid4().hex}{suffix}")
+
+
+def restore_video(event_id, store=None):
+    """
+    The hot path of an event's MP4, copying it back from the cold tier
+    first if needed. The cold copy is kept. Returns None if neither exists.
+    """
+    store = store or get_store()
+    path = store.path(event_id, "video")
+    if path is not None:
+        return path
+    src = cold_path(event_id, "video")
+    if not os.path.exists(src):
+        return None
+    current_app.logger.info(f"Restoring video for {event_id} from cold storage.")
+    staged = _staging_path(store, ".mp4")
+    _copy_file(src, staged)
+    return store.store(staged, event_id, "video")
+
+
+def readable_video(event_id, store=None):
+    """
+    A path an event's MP4 can be read from as it is: the hot copy, else the
+    cold one, which is stored uncompressed. Nothing is restored.
+    """
+    store = store or get_store()
+    path = store.path(event_id, "video")
+    if path is not None:
+        return path
+    cold = cold_path(event_id, "video")
+    return cold if os.path.exists(cold) else None
+
+
+def restore_json_file(event_id, store=None):
+    store = store or get_store()
+    path = store.path(event_id, "json")
+    if path is not None:
+        return path
+    src = cold_path(event_id, "json")
+    if not os.path.exists(src):
+        return None
+    current_app.logger.info(f"Restoring detection JSON for {event_id} from cold storage.")
+    staged = _staging_path(store, ".json")
+    _copy_file(src, staged, decompress=True)
+    return store.store(staged, event_id, "json")
+
+
+def restore_detections(detection):
+    """Puts the full detection_json back into the hot row. Caller commits."""
+    if detection is None or not detection.json_archived:
+        return False
+    archived = DetectionArchive.query.get(detection.event_id)
+    if archived is None:
+        current_app.logger.error(f"Detection JSON for {detection.event_id} is marked archived but missing.")
+        return False
+    detection.detection_json = archived.detection_json
+    detection.json_archived = False
+    archived.restored_at = datetime.utcnow()
+    return True
+
+
+def remove_cold(event_id):
+    for kind in ("video", "json"):
+        path = cold_path(event_id, kind)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _archive_event(event, policies, store, now, dry_run):
+    video_days, json_days = policy_for(event, policies)
+    age_days = (now - event.timestamp_start_utc).days
+    counts = {"videos": 0, "json_files": 0, "detections": 0}
+
+    # Items restored on demand count as young again until they age past the policy
+    if video_days and age_days > video_days:
+        path = store.path(event.event_id, "video")
+        if path is not None and _older_than(path, video_days):
+            counts["videos"] += dry_run or archive_video(event.event_id, store)
+
+    if json_days and age_days > json_days:
+        path = store.path(event.event_id, "json")
+        if path is not None and _older_than(path, json_days):
+            counts["json_files"] += dry_run or archive_json_file(event.event_id, store)
+
+        detection = event.detections
+        if detection is not None and not detection.json_archived:
+            archived = DetectionArchive.query.get(event.event_id)
+            restored_at = archived.restored_at if archived else None
+            if restored_at is None or (now - restored_at).days > json_days:
+                counts["detections"] += dry_run or archive_detections(detection)
+    return counts
+
+
+def run(batch_size, pause_seconds, limit=None, dry_run=False):
+    """
+    Walks events oldest first in batches of batch_size, archiving whatever
+    their policy says is due. Each batch is committed on its own and followed
+    by a pause, so the job never holds locks or saturates the disk for long.
+    Returns the totals.
+    """
+    policies = load_policies(current_app.config["RETENTION_POLICIES_FILE"])
+    all_days = [current_app.config["RETENTION_VIDEO_DAYS"], current_app.config["RETENTION_JSON_DAYS"]]
+    for rule in policies:
+        all_days += [rule.get("video_days") or 0, rule.get("json_days") or 0]
+    positive_days = [days for days in all_days if days]
+    totals = {"events": 0, "videos": 0, "json_files": 0, "detections": 0}
+    if not positive_days:
+        return totals
+
+    now = datetime.utcnow()
+    cutoff = now - timedelta(days=min(positive_days))
+    store = get_store()
+    last = None
+    while limit is None or totals["events"] < limit:
+        q = (Event.query
+             .options(selectinload(Event.detections), noload(Event.behaviors))
+             .filter(Event.timestamp_start_utc < cutoff))
+        if last is not None:
+            q = q.filter(db.tuple_(Event.timestamp_start_utc, Event.event_id) > db.tuple_(*last))
+        size = batch_size if limit is None else min(batch_size, limit - totals["events"])
+        events = q.order_by(Event.timestamp_start_utc, Event.event_id).limit(size).all()
+        if not events:
+            break
+
+        for event in events:
+            try:
+                counts = _archive_event(event, policies, store, now, dry_run)
+            except OSError as e:
+                current_app.logger.error(f"Archiving files for {event.event_id} failed: {e}")
+                continue
+            for key, value in counts.items():
+                totals[key] += value
+        totals["events"] += len(events)
+        last = (events[-1].timestamp_start_utc, events[-1].event_id)
+
+        if dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        db.session.expunge_all()
+        time.sleep(pause_seconds)
+    return totals
+
+
+retention_cli = AppGroup("retention", help="Move old videos and detection JSON to the cold tier.")
+
+
+@retention_cli.command("run")
+@click.option("--batch-size", type=int, default=None)
+@click.option("--pause", type=float, default=None, help="Seconds to sleep between batches.")
+@click.option("--limit", type=int, default=None, help="Maximum number of events to examine.")
+@click.option("--dry-run", is_flag=True, help="Count what would be archived without moving anything.")
+@with_appcontext
+def run_command(batch_size, pause, limit, dry_run):
+    """Archive everything the retention policies say is due."""
+    totals = run(
+        batch_size or current_app.config["RETENTION_BATCH_SIZE"],
+        current_app.config["RETENTION_BATCH_PAUSE_SECONDS"] if pause is None else pause,
+        limit=limit,
+        dry_run=dry_run,
+    )
+    verb = "Would archive" if dry_run else "Archived"
+    click.echo(f"Examined {totals['events']} events. {verb} {totals['videos']} videos, "
+               f"{totals['json_files']} JSON files and {totals['detections']} detection records.")
+
+
+@retention_cli.command("restore")
+@click.argument("event_ids", nargs=-1, required=True)
+@with_appcontext
+def restore_command(event_ids):
+    """Bring the given events back to the hot tier."""
+    store = get_store()
+    for event_id in event_ids:
+        event = Event.lookup(event_id)
+        if event is None:
+            click.echo(f"{event_id}: no such event")
+            continue
+        restore_video(event_id, store)
+        restore_json_file(event_id, store)
+        restore_detections(event.detections)
+        db.session.commit()
+        click.echo(f"{event_id}: restored")
@@ -0,0 +1,128 @@
+import time
+import threading
+from functools import wraps
+from flask import g, session, current_app, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+
+REPLICA_BIND = "replica"
+
+
+class RoutingSession(Session):
+    """
+    Sends a request's reads to the replica bind when the view opted in with
+    @replica_read and the replica is healthy. Flushes always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and g and g.get("db_bind") == REPLICA_BIND:
+            engine = self._db.engines.get(REPLICA_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Cap for the health probes, well below the bind's general statement timeout
+PROBE_TIMEOUT = "1s"
+
+
+class _ReplicaHealth:
+    """
+    Per-process cache of the replica's replication lag, refreshed every few
+    seconds. One thread runs the check; the others keep using the previous
+    value meanwhile (None, i.e. the primary, until the first check is done).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._checking = False
+        self._lag = None
+
+    def lag_seconds(self, engine, interval):
+        with self._lock:
+            if self._checking or time.monotonic() - self._checked_at < interval:
+                return self._lag
+            self._checking = True
+            self._checked_at = time.monotonic()
+
+        lag = None
+        try:
+            with engine.connect() as conn:
+                conn.execute(text(f"SET LOCAL statement_timeout = '{PROBE_TIMEOUT}'"))
+                # A standalone server (not in recovery) has no lag
+                lag = conn.execute(text(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0 "
+                    "WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )).scalar()
+        except Exception as e:
+            current_app.logger.warning(f"Replica health check failed, reading from primary: {e}")
+        finally:
+            with self._lock:
+                self._lag = lag
+                self._checking = False
+        return lag
+
+
+_health = _ReplicaHealth()
+
+
+def _replica_has_replayed(engine, lsn):
+    """True once the replica has replayed the primary's WAL up to lsn."""
+    try:
+        with engine.connect() as conn:
+            conn.execute(text(f"SET LOCAL statement_timeout = '{PROBE_TIMEOUT}'"))
+            return bool(conn.execute(
+                text("SELECT NOT pg_is_in_recovery() OR pg_last_wal_replay_lsn() >= CAST(:lsn AS pg_lsn)"),
+                {"lsn": lsn}
+            ).scalar())
+    except Exception:
+        return False
+
+
+def choose_bind():
+    """Returns REPLICA_BIND if this request's reads may go to the replica, else None."""
+    from app import db
+
+    engine = db.engines.get(REPLICA_BIND)
+    if engine is None:
+        return None
+
+    lag = _health.lag_seconds(engine, current_app.config["REPLICA_HEALTH_CHECK_SECONDS"])
+    if lag is None or lag > current_app.config["REPLICA_MAX_LAG_SECONDS"]:
+        return None
+
+    # Read-your-writes: after an edit, stay on the primary until the replica has caught up
+    write_lsn = session.get("write_lsn")
+    if write_lsn:
+        if not _replica_has_replayed(engine, write_lsn):
+            return None
+        session.pop("write_lsn", None)
+    return REPLICA_BIND
+
+
+def replica_read(f):
+    """Decorator for read-only views whose queries may be served by the replica."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.db_bind = choose_bind()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def remember_write_position(response):
+    """
+    after_request hook: when a signed-in user's write succeeds, store the
+    primary's WAL position in their session so their next reads can wait for it.
+    """
+    from app import db
+
+    if (REPLICA_BIND in db.engines and request.method in ("POST", "PUT", "PATCH", "DELETE")
+            and response.status_code < 400 and "user" in session):
+        try:
+            with db.engines[None].connect() as conn:
+                session["write_lsn"] = conn.execute(text("SELECT pg_current_wal_lsn()::text")).scalar()
+        except Exception as e:
+            current_app.logger.warning(f"Could not record write position: {e}")
+    return response
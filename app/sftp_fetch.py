@@ -0,0 +1,266 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import click
+import paramiko
+from flask import current_app
+from flask.cli import with_appcontext
+from app.models import Event
+from app.ingest import ingest_event
+from app.storage import FileStore
+from app.retention import is_archived
+
+
+def load_devices(path):
+    """
+    Reads the per-device SFTP settings, a JSON object keyed by device_id:
+    {"cam-01": {"host": "...", "port": 22, "username": "...", "key_filename": "..."}}
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def connect_device(device_id, settings):
+    """Opens an SFTP session to an edge device, verifying its host key."""
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    if settings.get("known_hosts"):
+        client.load_host_keys(settings["known_hosts"])
+    client.set_missing_host_key_policy(paramiko.RejectPolicy())
+    client.connect(
+        settings["host"],
+        port=settings.get("port", 22),
+        username=settings.get("username"),
+        password=settings.get("password"),
+        key_filename=settings.get("key_filename"),
+        timeout=settings.get("timeout", 30),
+    )
+    sftp = client.open_sftp()
+    # Keep the SSH client alive for as long as the SFTP session is
+    sftp.ssh_client = client
+    return sftp
+
+
+class DeviceUnreachable(Exception):
+    """Raised for jobs of a device whose connection already failed in this run."""
+
+
+class SFTPConnectionPool:
+    """
+    Keeps up to `size` persistent SFTP sessions per device. Sessions are
+    opened lazily, reused across downloads, and dropped when they fail.
+    A device that cannot be connected to is marked unreachable for the
+    rest of the pool's life, so its other jobs fail at once instead of each
+    waiting out the connect timeout. `connect(device_id, settings)` is
+    injectable so a local SFTP server stand-in can be used instead of real devices.
+    """
+
+    def __init__(self, devices, size=2, connect=connect_device):
+        self.devices = devices
+        self.size = size
+        self.connect = connect
+        self._idle = {}
+        self._slots = {}
+        self.unreachable = set()
+        self._lock = threading.Lock()
+
+    def _device_state(self, device_id):
+        with self._lock:
+            if device_id not in self._slots:
+                self._slots[device_id] = threading.BoundedSemaphore(self.size)
+                self._idle[device_id] = queue.LifoQueue()
+            return self._slots[device_id], self._idle[device_id]
+
+    @contextmanager
+    def acquire(self, device_id):
+        slots, idle = self._device_state(device_id)
+        with slots:
+            try:
+                sftp = idle.get_nowait()
+            except queue.Empty:
+                sftp = None
+            if sftp is None or not self._is_alive(sftp):
+                if device_id in self.unreachable:
+                    raise DeviceUnreachable(device_id)
+                try:
+                    sftp = self.connect(device_id, self.devices[device_id])
+                except Exception:
+                    self.unreachable.add(device_id)
+                    raise
+            try:
+                yield sftp
+            except Exception:
+                self._close(sftp)
+                raise
+            idle.put(sftp)
+
+    @staticmethod
+    def _is_alive(sftp):
+        channel = sftp.get_channel()
+        return channel is not None and not channel.closed and channel.get_transport().is_active()
+
+    @staticmethod
+    def _close(sftp):
+        try:
+            sftp.close()
+            client = getattr(sftp, "ssh_client", None)
+            if client is not None:
+                client.close()
+        except Exception:
+            pass
+
+    def close(self):
+        with self._lock:
+            for idle in self._idle.values():
+                while not idle.empty():
+                    self._close(idle.get_nowait())
+
+
+def _remote_checksum(sftp, remote_path):
+    """Reads the sha256 from a `<file>.sha256` sidecar next to the remote file, if there is one."""
+    try:
+        with sftp.open(f"{remote_path}.sha256", "r") as f:
+            return f.read(1024).decode("ascii", errors="replace").split()[0].lower()
+    except (IOError, IndexError):
+        return None
+
+
+def fetch_file(sftp, remote_path, part_path, chunk_size=1024 * 1024, max_requests=64):
+    """
+    Downloads one remote file to part_path with pipelined reads, resuming a
+    previous partial download if there is one. The file is verified against
+    the remote size (and sha256 sidecar, when present). Returns its sha256.
+    """
+    os.makedirs(os.path.dirname(part_path), exist_ok=True)
+    remote_size = sftp.stat(remote_path).st_size
+    expected_sha256 = _remote_checksum(sftp, remote_path)
+
+    digest = hashlib.sha256()
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if offset > remote_size:
+        offset = 0
+    if offset:
+        # Resume: the bytes already on disk still count towards the checksum
+        with open(part_path, "rb") as f:
+            for block in iter(lambda: f.read(chunk_size), b""):
+                digest.update(block)
+
+    with sftp.open(remote_path, "rb") as remote, open(part_path, "ab" if offset else "wb") as local:
+        remote.seek(offset)
+        remote.prefetch(remote_size, max_concurrent_requests=max_requests)
+        remaining = remote_size - offset
+        while remaining > 0:
+            block = remote.read(min(chunk_size, remaining))
+            if not block:
+                break
+            local.write(block)
+            digest.update(block)
+            remaining -= len(block)
+        local.flush()
+        os.fsync(local.fileno())
+
+    if os.path.getsize(part_path) != remote_size:
+        raise IOError(f"Incomplete download of {remote_path}: expected {remote_size} bytes")
+    if expected_sha256 and digest.hexdigest() != expected_sha256:
+        os.remove(part_path)
+        raise IOError(f"Checksum mismatch for {remote_path}")
+    return digest.hexdigest()
+
+
+def outstanding_transfers(store, device_ids=None):
+    """
+    Yields (event_id, device_id, [(remote_path, kind), ...]) for files not yet
+    on the server. Files moved to the cold tier by retention count as fetched.
+    """
+    q = Event.query.filter(
+        (Event.remote_video_path.isnot(None)) | (Event.remote_json_path.isnot(None))
+    )
+    if device_ids:
+        q = q.filter(Event.device_id.in_(device_ids))
+
+    rows = q.with_entities(Event.event_id, Event.device_id, Event.remote_json_path, Event.remote_video_path)
+    for event_id, device_id, remote_json, remote_video in rows.yield_per(500):
+        files = []
+        # JSON first, so the detections are in place by the time the video lands
+        if remote_json and not store.exists(event_id, "json") and not is_archived(event_id, "json"):
+            files.append((remote_json, "json"))
+        if remote_video and not store.exists(event_id, "video") and not is_archived(event_id, "video"):
+            files.append((remote_video, "video"))
+        if files:
+            yield event_id, device_id, files
+
+
+def pull_outstanding(device_ids=None, limit=None, connect=connect_device):
+    """
+    Downloads every outstanding remote file concurrently and runs the
+    ingest stages for each event whose files all arrived.
+    Returns (events fetched, events failed).
+    """
+    config = current_app.config
+    devices = load_devices(config["SFTP_DEVICES_FILE"])
+    store = FileStore.from_config(config)
+    partial_folder = os.path.join(store.root, ".partial")
+
+    jobs = []
+    for event_id, device_id, files in outstanding_transfers(store, device_ids):
+        if device_id not in devices:
+            continue
+        jobs.append((event_id, device_id, files))
+        if limit and len(jobs) >= limit:
+            break
+
+    pool = SFTPConnectionPool(devices, size=config["SFTP_CONNECTIONS_PER_DEVICE"], connect=connect)
+
+    def fetch_event(event_id, device_id, files):
+        with pool.acquire(device_id) as sftp:
+            for remote_path, kind in files:
+                part_path = os.path.join(partial_folder, f"{event_id}.{kind}.part")
+                sha256 = fetch_file(sftp, remote_path, part_path,
+                                    chunk_size=config["SFTP_CHUNK_SIZE"],
+                                    max_requests=config["SFTP_MAX_REQUESTS"])
+                store.store(part_path, event_id, kind, sha256=sha256)
+
+    fetched, failed = 0, 0
+    try:
+        with ThreadPoolExecutor(max_workers=config["SFTP_WORKERS"]) as executor:
+            futures = {
+                executor.submit(fetch_event, event_id, device_id, files): event_id
+                for event_id, device_id, files in jobs
+            }
+            # Downloads run in worker threads; ingest stays on this thread, which owns the app context
+            for future in as_completed(futures):
+                event_id = futures[future]
+                try:
+                    future.result()
+                except DeviceUnreachable:
+                    failed += 1
+                    continue
+                except Exception as e:
+                    failed += 1
+                    current_app.logger.error(f"SFTP fetch failed for event {event_id}: {e}")
+                    continue
+                fetched += 1
+                ingest_event(event_id)
+    finally:
+        pool.close()
+
+    for device_id in sorted(pool.unreachable):
+        current_app.logger.warning(f"Device {device_id} was unreachable; its events are left for the next run.")
+
+    return fetched, failed
+
+
+@click.command("sftp-pull")
+@click.option("--device", "device_ids", multiple=True, help="Only pull from these devices.")
+@click.option("--limit", type=int, default=None, help="Maximum number of events to fetch.")
+@with_appcontext
+def sftp_pull_command(device_ids, limit):
+    """Pull outstanding video and JSON files from edge devices over SFTP."""
+    fetched, failed = pull_outstanding(device_ids=device_ids or None, limit=limit)
+    click.echo(f"Fetched {fetched} events, {failed} failed.")
@@ -0,0 +1,272 @@
+import os
+import json
+import math
+import fcntl
+import threading
+from contextlib import contextmanager
+import click
+import numpy as np
+from sqlalchemy.orm import selectinload
+from flask import current_app
+from flask.cli import with_appcontext, AppGroup
+from app import db
+from app.models import Event
+
+# Signature layout: class incidence and log max-count per vocabulary slot,
+# then sin/cos of the hour of day, log duration and max confidence.
+MAX_CLASSES = 64
+DIM = 2 * MAX_CLASSES + 4
+ID_DTYPE = "S64"
+GROW_ROWS = 4096
+
+# Relative weight of each block in the distance
+INCIDENCE_WEIGHT = 1.0
+COUNT_WEIGHT = 0.5
+HOUR_WEIGHT = 0.5
+DURATION_WEIGHT = 0.5
+CONFIDENCE_WEIGHT = 0.5
+
+
+def _folder():
+    return current_app.config["SIGNATURE_FOLDER"]
+
+
+def _paths(folder):
+    return {
+        "meta": os.path.join(folder, "meta.json"),
+        "vectors": os.path.join(folder, "signatures.f32"),
+        "ids": os.path.join(folder, "ids.s64"),
+        "lock": os.path.join(folder, ".lock"),
+    }
+
+
+def _read_meta(folder):
+    try:
+        with open(_paths(folder)["meta"], "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"dim": DIM, "rows": 0, "capacity": 0, "classes": []}
+
+
+def _write_meta(folder, meta):
+    path = _paths(folder)["meta"]
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(meta, f)
+    os.replace(f"{path}.tmp", path)
+
+
+@contextmanager
+def _locked(folder):
+    """Serialises writers across threads and worker processes."""
+    os.makedirs(folder, exist_ok=True)
+    with open(_paths(folder)["lock"], "a") as lock_file:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def _open_matrices(folder, capacity, mode):
+    paths = _paths(folder)
+    vectors = np.memmap(paths["vectors"], dtype=np.float32, mode=mode, shape=(capacity, DIM))
+    ids = np.memmap(paths["ids"], dtype=ID_DTYPE, mode=mode, shape=(capacity,))
+    return vectors, ids
+
+
+def _ensure_capacity(folder, meta, rows_needed):
+    """Grows both files in GROW_ROWS steps; new rows are zero, i.e. empty ids."""
+    if rows_needed <= meta["capacity"]:
+        return
+    capacity = max(rows_needed, meta["capacity"] + GROW_ROWS)
+    paths = _paths(folder)
+    for path, row_bytes in ((paths["vectors"], DIM * 4), (paths["ids"], np.dtype(ID_DTYPE).itemsize)):
+        with open(path, "ab") as f:
+            f.truncate(capacity * row_bytes)
+    meta["capacity"] = capacity
+
+
+def event_signature(event, classes):
+    """
+    Builds the signature of one event. `classes` is the shared class
+    vocabulary and is extended in place for classes seen for the first time.
+    """
+    vector = np.zeros(DIM, dtype=np.float32)
+    detection = event.detections
+    class_names = []
+    max_counts = {}
+    max_confidence = 0.0
+    if detection is not None:
+        class_names = detection.classes_modified or detection.classes_detected or []
+        max_counts = {stat.class_name: stat.max_count for stat in event.class_stats}
+        if not max_counts and isinstance(detection.max_count_per_frame, dict):
+            max_counts = detection.max_count_per_frame
+        summary = (detection.detection_json or {}).get("event_summary") or {}
+        max_confidence = float(summary.get("max_confidence") or 0.0)
+
+    for class_name in set(class_names) | set(max_counts):
+        if class_name not in classes:
+            if len(classes) >= MAX_CLASSES:
+                continue
+            classes.append(class_name)
+        slot = classes.index(class_name)
+        if class_name in class_names:
+            vector[slot] = INCIDENCE_WEIGHT
+        count = max_counts.get(class_name) or 0
+        vector[MAX_CLASSES + slot] = COUNT_WEIGHT * math.log1p(float(count))
+
+    hour = event.timestamp_start_utc.hour + event.timestamp_start_utc.minute / 60.0
+    angle = 2 * math.pi * hour / 24.0
+    vector[2 * MAX_CLASSES] = HOUR_WEIGHT * math.sin(angle)
+    vector[2 * MAX_CLASSES + 1] = HOUR_WEIGHT * math.cos(angle)
+    vector[2 * MAX_CLASSES + 2] = DURATION_WEIGHT * math.log1p(max(event.video_duration_seconds, 0.0))
+    vector[2 * MAX_CLASSES + 3] = CONFIDENCE_WEIGHT * max_confidence
+    return vector
+
+
+def _row_of(ids, rows, event_id):
+    key = event_id.encode("utf-8")
+    matches = np.flatnonzero(ids[:rows] == key)
+    return int(matches[0]) if len(matches) else None
+
+
+def update_events(events):
+    """Writes (or overwrites) the signatures of the given events."""
+    folder = _folder()
+    with _locked(folder):
+        meta = _read_meta(folder)
+        _ensure_capacity(folder, meta, meta["rows"] + len(events))
+        vectors, ids = _open_matrices(folder, meta["capacity"], "r+")
+        if len(events) == 1:
+            row = _row_of(ids, meta["rows"], events[0].event_id)
+            index = {} if row is None else {events[0].event_id.encode("utf-8"): row}
+        else:
+            index = {key: i for i, key in enumerate(ids[:meta["rows"]].tolist()) if key}
+        for event in events:
+            key = event.event_id.encode("utf-8")
+            row = index.get(key)
+            if row is None:
+                row = meta["rows"]
+                meta["rows"] += 1
+                ids[row] = key
+                index[key] = row
+            vectors[row] = event_signature(event, meta["classes"])
+        vectors.flush()
+        ids.flush()
+        _write_meta(folder, meta)
+
+
+def update_event(event):
+    update_events([event])
+
+
+def update_event_ids(event_ids, batch_size=1000):
+    """Writes the signatures of many events, loading them a batch at a time."""
+    for start in range(0, len(event_ids), batch_size):
+        chunk = event_ids[start:start + batch_size]
+        events = Event.query.options(selectinload(Event.class_stats)).filter(Event.event_id.in_(chunk)).all()
+        update_events(events)
+        db.session.expunge_all()
+
+
+def remove_event(event_id):
+    """Blanks an event's row; blank rows are skipped by queries."""
+    folder = _folder()
+    with _locked(folder):
+        meta = _read_meta(folder)
+        if not meta["rows"]:
+            return
+        vectors, ids = _open_matrices(folder, meta["capacity"], "r+")
+        row = _row_of(ids, meta["rows"], event_id)
+        if row is not None:
+            ids[row] = b""
+            vectors[row] = 0
+            ids.flush()
+            vectors.flush()
+
+
+class _Reader:
+    """Read-only view of the matrix, reopened whenever a writer has changed it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._state = None
+
+    def get(self, folder):
+        meta_path = _paths(folder)["meta"]
+        try:
+            stamp = os.stat(meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if stamp != self._stamp:
+                meta = _read_meta(folder)
+                if not meta["rows"]:
+                    return None
+                vectors, ids = _open_matrices(folder, meta["capacity"], "r")
+                self._state = (meta, vectors, ids)
+                self._stamp = stamp
+            return self._state
+
+
+_reader = _Reader()
+
+
+def nearest(event_id, k=10):
+    """
+    Returns [(event_id, distance), ...] for the k events whose signatures are
+    closest to the given event's, scanning the matrix in fixed-size batches.
+    """
+    state = _reader.get(_folder())
+    if state is None:
+        return []
+    meta, vectors, ids = state
+    rows = meta["rows"]
+    batch_rows = current_app.config["SIMILARITY_BATCH_ROWS"]
+
+    row = _row_of(ids, rows, event_id)
+    if row is not None:
+        query = np.array(vectors[row])
+    else:
+        event = Event.lookup(event_id)
+        if event is None:
+            return []
+        query = event_signature(event, list(meta["classes"]))
+
+    best_ids = np.empty(0, dtype=ID_DTYPE)
+    best_dist = np.empty(0, dtype=np.float32)
+    for start in range(0, rows, batch_rows):
+        block = vectors[start:start + batch_rows]
+        block_ids = ids[start:start + batch_rows]
+        diff = block - query
+        dist = np.einsum("ij,ij->i", diff, diff)
+        # Skip deleted rows and the query event itself
+        dist[(block_ids == b"") | (block_ids == event_id.encode("utf-8"))] = np.inf
+        if len(dist) > k:
+            keep = np.argpartition(dist, k)[:k]
+            dist, block_ids = dist[keep], block_ids[keep]
+        best_ids = np.concatenate([best_ids, block_ids])
+        best_dist = np.concatenate([best_dist, dist])
+        if len(best_dist) > k:
+            keep = np.argpartition(best_dist, k)[:k]
+            best_ids, best_dist = best_ids[keep], best_dist[keep]
+
+    order = np.argsort(best_dist)
+    return [
+        (best_ids[i].decode("utf-8"), float(np.sqrt(best_dist[i])))
+        for i in order if np.isfinite(best_dist[i])
+    ]
+
+
+similarity_cli = AppGroup("similarity", help="Maintain the event signature matrix.")
+
+
+@similarity_cli.command("rebuild")
+@click.option("--batch-size", type=int, default=1000)
+@with_appcontext
+def rebuild_command(batch_size):
+    """Recompute the signature of every event."""
+    event_ids = [row[0] for row in db.session.query(Event.event_id).order_by(Event.event_id)]
+    update_event_ids(event_ids, batch_size)
+    click.echo(f"Wrote signatures for {len(event_ids)} events.")
@@ -0,0 +1,118 @@
+import numpy as np
+from app import db
+from app.models import EventClassStat
+
+
+def _first(d, *keys, default=None):
+    for key in keys:
+        if key in d and d[key] is not None:
+            return d[key]
+    return default
+
+
+def frame_detections(detection_json):
+    """
+    Flattens the per-frame detections of an event JSON into parallel lists
+    of (frame index, class name, confidence, bbox). Frames without an
+    explicit index are numbered by their position.
+    """
+    frames = _first(detection_json, "frames", "detections", default=[])
+    frame_ids, class_names, confidences, boxes = [], [], [], []
+    if not isinstance(frames, list):
+        return frame_ids, class_names, confidences, boxes
+
+    for position, frame in enumerate(frames):
+        if not isinstance(frame, dict):
+            continue
+        frame_id = _first(frame, "frame_index", "frame_number", "frame", default=position)
+        for obj in _first(frame, "detections", "objects", default=[]):
+            class_name = _first(obj, "class_name", "class", "label")
+            if class_name is None:
+                continue
+            frame_ids.append(int(frame_id))
+            class_names.append(str(class_name))
+            confidences.append(float(_first(obj, "confidence", "conf", default=0.0)))
+            boxes.append(_first(obj, "bbox", "box", "xyxy"))
+    return frame_ids, class_names, confidences, boxes
+
+
+def frame_count(detection_json):
+    """
+    Total frames of the event: recorded in the JSON, or one past the highest
+    explicit frame index. The length of the frames list is not used, it may
+    only hold the frames that had detections. None if it cannot be told.
+    """
+    total_frames = _first(detection_json, "total_frames", "frame_count", default=None)
+    if total_frames:
+        return int(total_frames)
+    frames = _first(detection_json, "frames", "detections", default=[])
+    if not isinstance(frames, list):
+        return None
+    indices = [
+        _first(frame, "frame_index", "frame_number", "frame")
+        for frame in frames if isinstance(frame, dict)
+    ]
+    indices = [int(index) for index in indices if index is not None]
+    return max(indices) + 1 if indices else None
+
+
+def frames_per_second(detection_json, n_frames, duration):
+    """Reads the frame rate from the JSON, or derives it from the event duration."""
+    summary = detection_json.get("event_summary") or {}
+    fps = _first(detection_json, "fps", default=None) or _first(summary, "fps", default=None)
+    if fps:
+        return float(fps)
+    if duration and n_frames:
+        return n_frames / duration
+    return None
+
+
+def compute_class_stats(detection_json, duration=None):
+    """
+    Computes per-class statistics for one event from its frame detections:
+    max count in a single frame, frames present, dwell seconds and mean confidence.
+    Dwell is None when the frame rate cannot be determined.
+    """
+    frame_ids, class_names, confidences, _ = frame_detections(detection_json)
+    if not class_names:
+        return []
+
+    frames, frame_idx = np.unique(np.asarray(frame_ids), return_inverse=True)
+    classes, class_idx = np.unique(np.asarray(class_names), return_inverse=True)
+    n_frames, n_classes = len(frames), len(classes)
+    conf = np.asarray(confidences, dtype=np.float64)
+
+    # Detections per (frame, class) cell
+    counts = np.bincount(frame_idx * n_classes + class_idx, minlength=n_frames * n_classes)
+    counts = counts.reshape(n_frames, n_classes)
+    max_count = counts.max(axis=0)
+    frames_present = (counts > 0).sum(axis=0)
+
+    n_detections = np.bincount(class_idx, minlength=n_classes)
+    mean_confidence = np.bincount(class_idx, weights=conf, minlength=n_classes) / n_detections
+
+    fps = frames_per_second(detection_json, frame_count(detection_json), duration)
+    dwell = frames_present / fps if fps else [None] * n_classes
+
+    return [
+        {
+            "class_name": str(classes[i]),
+            "max_count": int(max_count[i]),
+            "frames_present": int(frames_present[i]),
+            "dwell_seconds": float(dwell[i]) if dwell[i] is not None else None,
+            "mean_confidence": float(mean_confidence[i]),
+        }
+        for i in range(n_classes)
+    ]
+
+
+def update_event_stats(event):
+    """Replaces the stored per-class statistics of an event. Caller commits."""
+    if not event.detections:
+        return 0
+
+    EventClassStat.query.filter_by(event_id=event.event_id).delete(synchronize_session=False)
+    rows = compute_class_stats(event.detections.detection_json, event.video_duration_seconds)
+    for row in rows:
+        db.session.add(EventClassStat(event_id=event.event_id, **row))
+    return len(rows)
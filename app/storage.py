@@ -0,0 +1,194 @@
+import os
+import json
+import hashlib
+import click
+from flask import current_app
+from flask.cli import with_appcontext, AppGroup
+
+KINDS = {"video": ".mp4", "json": ".json"}
+
+
+class FileStore:
+    """
+    Resolves where an event's video and detection JSON live on disk.
+
+    With sharding on, files are spread over two levels of hashed
+    subdirectories (`ab/cd/<event_id>.mp4`) so no directory grows past a
+    few thousand entries. With dedup on, videos are stored once per
+    sha256 under `blobs/` and each event path is a hard link to its blob.
+    The old flat layout is still read, so files can be migrated while the
+    application is serving them.
+    """
+
+    def __init__(self, root, sharded=True, dedup=False):
+        self.root = root
+        self.sharded = sharded
+        self.dedup = dedup
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config["WATCH_FOLDER"], config["STORAGE_SHARDED"], config["STORAGE_DEDUP"])
+
+    @staticmethod
+    def shard(key):
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return os.path.join(digest[:2], digest[2:4])
+
+    def _base_dir(self, kind):
+        return os.path.join(self.root, "detections") if kind == "json" else self.root
+
+    def flat_path(self, event_id, kind="video"):
+        return os.path.join(self._base_dir(kind), f"{event_id}{KINDS[kind]}")
+
+    def sharded_path(self, event_id, kind="video"):
+        return os.path.join(self._base_dir(kind), self.shard(event_id), f"{event_id}{KINDS[kind]}")
+
+    def target_path(self, event_id, kind="video"):
+        """Where a new file for this event is written."""
+        return self.sharded_path(event_id, kind) if self.sharded else self.flat_path(event_id, kind)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, "blobs", sha256[:2], sha256[2:4], f"{sha256}.mp4")
+
+    def path(self, event_id, kind="video"):
+        """The existing file for an event, or None."""
+        sharded = self.sharded_path(event_id, kind)
+        if os.path.exists(sharded):
+            return sharded
+        flat = self.flat_path(event_id, kind)
+        if os.path.exists(flat):
+            return flat
+        # A migration may have moved the file between the two checks
+        if os.path.exists(sharded):
+            return sharded
+        return None
+
+    def exists(self, event_id, kind="video"):
+        return self.path(event_id, kind) is not None
+
+    def store(self, src_path, event_id, kind="video", sha256=None):
+        """
+        Moves a finished file into place atomically. src_path must be on the
+        same filesystem as the store. Returns the event's path.
+        """
+        dest = self.target_path(event_id, kind)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+
+        if kind == "video" and self.dedup:
+            sha256 = sha256 or file_sha256(src_path)
+            blob = self.blob_path(sha256)
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            try:
+                os.link(src_path, blob)
+            except FileExistsError:
+                # Re-delivered duplicate: the existing blob is reused
+                pass
+            staged = f"{dest}.link"
+            if os.path.exists(staged):
+                os.remove(staged)
+            os.link(blob, staged)
+            os.replace(staged, dest)
+            # Removed only after dest exists, so readers never see a gap
+            if os.path.abspath(src_path) != os.path.abspath(dest):
+                os.remove(src_path)
+        else:
+            os.replace(src_path, dest)
+
+        flat = self.flat_path(event_id, kind)
+        if dest != flat and os.path.exists(flat):
+            os.remove(flat)
+        return dest
+
+    def delete(self, event_id, kinds=tuple(KINDS)):
+        """
+        Removes an event's files of the given kinds in either layout. Blobs
+        left without references are reclaimed by `collect_garbage`.
+        """
+        for kind in kinds:
+            for path in (self.sharded_path(event_id, kind), self.flat_path(event_id, kind)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def read_json(self, event_id):
+        path = self.path(event_id, "json")
+        if path is None:
+            raise FileNotFoundError(f"No detection JSON for event {event_id}")
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def write_json(self, event_id, data):
+        """Rewrites an event's detection JSON in place, atomically."""
+        path = self.path(event_id, "json") or self.target_path(event_id, "json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(tmp_path, path)
+
+    def migrate(self, limit=None):
+        """
+        Moves files from the flat layout into the sharded (and, if enabled,
+        deduplicated) layout one at a time. Safe to run while serving and
+        to interrupt. Returns the number of files moved.
+        """
+        moved = 0
+        for kind, extension in KINDS.items():
+            base = self._base_dir(kind)
+            if not os.path.isdir(base):
+                continue
+            with os.scandir(base) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.endswith(extension):
+                        continue
+                    event_id = entry.name[:-len(extension)]
+                    self.store(entry.path, event_id, kind)
+                    moved += 1
+                    if limit and moved >= limit:
+                        return moved
+        return moved
+
+    def collect_garbage(self):
+        """Removes blobs that no event path links to any more. Returns the number removed."""
+        removed = 0
+        blobs_root = os.path.join(self.root, "blobs")
+        for dirpath, _, filenames in os.walk(blobs_root):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                if os.stat(path).st_nlink <= 1:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+
+def file_sha256(path, block_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_store():
+    return FileStore.from_config(current_app.config)
+
+
+storage_cli = AppGroup("storage", help="Manage the on-disk video and JSON layout.")
+
+
+@storage_cli.command("migrate")
+@click.option("--limit", type=int, default=None, help="Maximum number of files to move.")
+@with_appcontext
+def migrate_command(limit):
+    """Move files from the flat layout into the sharded layout."""
+    store = get_store()
+    if not store.sharded and not store.dedup:
+        click.echo("STORAGE_SHARDED and STORAGE_DEDUP are both off; nothing to migrate.")
+        return
+    click.echo(f"Moved {store.migrate(limit=limit)} files.")
+
+
+@storage_cli.command("gc")
+@with_appcontext
+def gc_command():
+    """Remove deduplicated blobs no event refers to."""
+    click.echo(f"Removed {get_store().collect_garbage()} unreferenced blobs.")
@@ -1,15 +1,22 @@
 import os, json
 import io
+import math
 from datetime import datetime, timedelta
 from flask import (
     Blueprint, request, current_app,
-    render_template, redirect, url_for, send_from_directory, jsonify, send_file, session
+    render_template, redirect, url_for, send_from_directory, jsonify, send_file, session, abort
 )
-from sqlalchemy import cast, Integer, or_, extract, and_, func
+from sqlalchemy import cast, Integer, or_, extract, and_, func, case
 from app import db
-from app.models import Event, Detection, Behavior, BehaviorChoice
+from app.models import Event, Detection, Behavior, BehaviorChoice, EventClassStat, OccupancyGrid
+from app import media, resumable, similarity, occupancy, clips, retention
+from app import admission as admission_control
+from app.ingest import ingest_in_background
+from app.storage import get_store
 import zipfile
-from app import login_required, admin_required
+from app import login_required, admin_required, device_token_required
+from app.routing import replica_read
+from app.admission import admission
 import plotly
 import plotly.express as px
 import plotly.graph_objects as go
@@ -25,6 +32,8 @@ def index():
     return redirect(url_for("main.search_videos"))
 
 @main_bp.route("/search", methods=["GET"])
+@admission('interactive')
+@replica_read
 def search_videos():
     page = request.args.get("page", 1, type=int)
     class_name_str = request.args.get("class_name", type=str)
@@ -35,17 +44,23 @@ def search_videos():
     device_id = request.args.get("device_id", type=str)
     time_of_day = request.args.get("time_of_day", type=str)
     min_confidence = request.args.get("min_confidence", type=float)
-    sort_by = request.args.get("sort_by", "recent", type=str)
+    min_count = request.args.get("min_count", type=int)
+    min_dwell = request.args.get("min_dwell", type=float)
+    similar_to = request.args.get("similar_to", type=str)
+    sort_by = request.args.get("sort_by", "similarity" if similar_to else "recent", type=str)
     search_performed = bool(request.args)
     events = []
     
     selected_behavior = request.args.get('behavior', '')
-    available_behaviors = db.session.query(Behavior.behavior_description).distinct().order_by(Behavior.behavior_description).all()
+    # Joined to events so behaviors of detached months are left out
+    available_behaviors = db.session.query(Behavior.behavior_description).join(
+        Event, Event.event_id == Behavior.event_id).distinct().order_by(Behavior.behavior_description).all()
     available_behaviors = [b[0] for b in available_behaviors]
 
-    q = Event.query.join(Detection)
+    q = Event.query.join(Event.detections)
 
     # --- Conditionally apply filters ONLY if criteria are provided ---
+    class_names_lower = []
     if class_name_str:
         class_names_original = [name.strip() for name in class_name_str.split(',') if name.strip()]
         class_names_lower = [name.lower() for name in class_names_original]
@@ -83,18 +98,52 @@ def search_videos():
     if min_confidence is not None:
         q = q.filter(Detection.detection_json['event_summary']['max_confidence'].as_float() >= min_confidence)
 
+    # --- Per-class count statistics (restricted to the searched classes, if any) ---
+    stats_sq = None
+    if min_count is not None or min_dwell is not None or sort_by in ('most_animals', 'longest_dwell'):
+        stats_q = db.session.query(
+            EventClassStat.event_id.label("event_id"),
+            func.max(EventClassStat.max_count).label("peak_count"),
+            func.max(EventClassStat.dwell_seconds).label("peak_dwell")
+        )
+        if class_names_lower:
+            stats_q = stats_q.filter(func.lower(EventClassStat.class_name).in_(class_names_lower))
+        if min_count is not None:
+            stats_q = stats_q.filter(EventClassStat.max_count >= min_count)
+        if min_dwell is not None:
+            stats_q = stats_q.filter(EventClassStat.dwell_seconds >= min_dwell)
+        stats_sq = stats_q.group_by(EventClassStat.event_id).subquery()
+
+        if min_count is not None or min_dwell is not None:
+            q = q.join(stats_sq, stats_sq.c.event_id == Event.event_id)
+        else:
+            # Sorting only: keep events that have no statistics yet
+            q = q.outerjoin(stats_sq, stats_sq.c.event_id == Event.event_id)
+
+    # --- Restrict to the nearest neighbours of an event ---
+    similar_ids = []
+    if similar_to:
+        similar_ids = [neighbour_id for neighbour_id, _ in similarity.nearest(similar_to, k=current_app.config["SIMILAR_SEARCH_K"])]
+        q = q.filter(Event.event_id.in_(similar_ids))
+
     # --- Apply sorting to the final query ---
-    if sort_by == 'oldest':
+    if sort_by == 'similarity' and similar_ids:
+        q = q.order_by(case({event_id: rank for rank, event_id in enumerate(similar_ids)}, value=Event.event_id))
+    elif sort_by == 'oldest':
         q = q.order_by(Event.timestamp_start_utc.asc())
     elif sort_by == 'longest':
         q = q.order_by(Event.video_duration_seconds.desc())
     elif sort_by == 'shortest':
         q = q.order_by(Event.video_duration_seconds.asc())
+    elif sort_by == 'most_animals':
+        q = q.order_by(stats_sq.c.peak_count.desc().nullslast(), Event.timestamp_start_utc.desc())
+    elif sort_by == 'longest_dwell':
+        q = q.order_by(stats_sq.c.peak_dwell.desc().nullslast(), Event.timestamp_start_utc.desc())
     else: # Default to 'recent'
         q = q.order_by(Event.timestamp_start_utc.desc())
     
     if selected_behavior:
-        q = q.join(Behavior).filter(Behavior.behavior_description == selected_behavior)
+        q = q.join(Event.behaviors).filter(Behavior.behavior_description == selected_behavior)
 
     pagination = q.paginate(page=page, per_page=30, error_out=False)
     events = pagination.items
@@ -109,11 +158,13 @@ def search_videos():
     return render_template("search.html", events=events, class_name=class_name_str, pagination=pagination,
                            min_duration=min_duration, start_date=start_date_str,end_date=end_date_str,
                            device_id=device_id,time_of_day=time_of_day,min_confidence=min_confidence,sort_by=sort_by,
+                           min_count=min_count, min_dwell=min_dwell, similar_to=similar_to,
                            match_type=match_type, search_args=search_args,
                            search_performed=search_performed, available_classes=available_classes, available_behaviors = available_behaviors
                            , selected_behavior=selected_behavior)
     
 @main_bp.route("/api/behavior_choices", methods=["GET"])
+@replica_read
 def get_behavior_choices():
     choices = BehaviorChoice.query.order_by(BehaviorChoice.name).all()
     choices_names = [choice.name for choice in choices]
@@ -149,7 +200,7 @@ def add_behavior_choice():
 @admin_required
 def add_behavior(event_id: str):
     """Admin-only route to add a behavior annotation to an event."""
-    event = Event.query.get(event_id)
+    event = Event.lookup(event_id)
     if not event:
         return jsonify({"success": False, "error": "Event not found"}), 404
 
@@ -182,14 +233,11 @@ def add_behavior(event_id: str):
         
         ##  saving to JSON file ---
         
-        json_filename = f"{event_id}.json"
-        
-        detections_directory = os.path.join(current_app.root_path, 'uploads', 'incoming', 'detections')
-        json_file_path = os.path.join(detections_directory, json_filename)
+        store = get_store()
+        retention.restore_json_file(event_id, store)
         
         try:
-            with open(json_file_path, 'r') as f:
-                event_data = json.load(f)
+            event_data = store.read_json(event_id)
         except (FileNotFoundError, json.JSONDecodeError):
             return jsonify({"success": False, "error": f"JSON file not found or is invalid for event {event_id}."}), 404
 
@@ -205,8 +253,7 @@ def add_behavior(event_id: str):
         behavior_list.append(new_behavior_dict)
         event_data["behaviors"] = behavior_list
         
-        with open(json_file_path, 'w') as f:
-            json.dump(event_data, f, indent=4)
+        store.write_json(event_id, event_data)
         
         return jsonify({
             "success": True,
@@ -236,21 +283,18 @@ def delete_behavior(behavior_id):
         db.session.delete(behavior_to_delete)
         db.session.commit()
         
-        json_filename = f"{event_id}.json"
-        detections_directory = os.path.join(current_app.root_path, 'uploads', 'incoming', 'detections')
-        json_file_path = os.path.join(detections_directory, json_filename)
+        store = get_store()
+        retention.restore_json_file(event_id, store)
         
-        if os.path.exists(json_file_path):
-            with open (json_file_path, 'r') as f:
-                event_data = json.load(f)
+        if store.exists(event_id, "json"):
+            event_data = store.read_json(event_id)
                 
             behavior_list = event_data.get('behaviors', [])
             updated_behaviors = [b for b in behavior_list if not (b.get('start_time_seconds')== behavior_to_delete.start_time_seconds and b.get('behavior_description') == behavior_to_delete.behavior_description)]
             
             event_data['behaviors'] = updated_behaviors
             
-            with open(json_file_path, 'w') as f:
-                json.dump(event_data, f, indent=4)
+            store.write_json(event_id, event_data)
                 
         return jsonify({"success": True, "message": "Behavior deleted successfully."})
         
@@ -263,7 +307,7 @@ def delete_behavior(behavior_id):
 @admin_required
 def change_class(event_id: str):
     """Admin-only route to modify the detected classes for an event."""
-    event = Event.query.get(event_id)
+    event = Event.lookup(event_id)
     if not event or not event.detections:
         return jsonify({"success": False, "error": "Event not found"}), 404
 
@@ -278,13 +322,11 @@ def change_class(event_id: str):
         event.detections.classes_modified = new_classes_list
         db.session.commit()
         
-        json_filename = f"{event_id}.json"
-        detections_directory = os.path.join(current_app.root_path, 'uploads', 'incoming', 'detections')
-        json_file_path = os.path.join(detections_directory, json_filename)
+        store = get_store()
+        retention.restore_json_file(event_id, store)
         
         try:
-            with open(json_file_path, 'r') as f:
-                event_data = json.load(f)
+            event_data = store.read_json(event_id)
         
         except (FileNotFoundError, json.JSONDecodeError):
             current_app.logger.error(f"Could not find or read JSON file to update classes for event {event_id}.")
@@ -296,8 +338,7 @@ def change_class(event_id: str):
             
         event_data['classes_modified'] = new_classes_list
         
-        with open(json_file_path, 'w') as f:
-            json.dump(event_data, f, indent=4)
+        store.write_json(event_id, event_data)
         
         return jsonify({
             "success": True, 
@@ -313,21 +354,25 @@ def change_class(event_id: str):
 @admin_required
 def delete_video(event_id: str):
     """Admin-only route to delete a video and its DB records."""
-    event = Event.query.get(event_id)
+    event = Event.lookup(event_id)
     if not event:
         return jsonify({"success": False, "error": "Event not found"}), 404
 
-    # Delete the video file
+    # Delete the video and JSON files
     try:
-        video_path = os.path.join(current_app.config["WATCH_FOLDER"], f"{event.event_id}.mp4")
-        if os.path.exists(video_path):
-            os.remove(video_path)
+        get_store().delete(event.event_id)
+        media.remove_renditions(event.event_id)
+        similarity.remove_event(event.event_id)
+        retention.remove_cold(event.event_id)
     except OSError as e:
         # Log the error but proceed to delete the DB record anyway
-        current_app.logger.error(f"Error deleting video file {video_path}: {e}")
+        current_app.logger.error(f"Error deleting files for event {event_id}: {e}")
 
     # Delete the database record (cascades to detections)
     try:
+        # The grids can only be decremented from the full per-frame JSON
+        retention.restore_detections(event.detections)
+        occupancy.remove_event(event)
         db.session.delete(event)
         db.session.commit()
         return jsonify({"success": True, "message": f"Event {event_id} deleted."}), 200
@@ -338,52 +383,248 @@ def delete_video(event_id: str):
 
 @main_bp.route("/download/<string:event_id>", methods=["GET"])
 @main_bp.route("/download/<string:event_id>.mp4", methods=["GET"])
+@replica_read
 def download_video(event_id: str):
-    event = Event.query.get_or_404(event_id)
-    return send_from_directory(
-        current_app.config["WATCH_FOLDER"], f"{event.event_id}.mp4"
-    )
+    event = Event.lookup(event_id) or abort(404)
+    video_path = retention.restore_video(event.event_id)
+    if video_path is None:
+        abort(404)
+    return send_file(video_path, mimetype="video/mp4", conditional=True)
     
+@main_bp.route("/preview/<string:event_id>.mp4", methods=["GET"])
+def preview_video(event_id: str):
+    """Serves the low-bitrate preview rendition built at ingest."""
+    return send_from_directory(media.renditions_dir(event_id), "preview.mp4")
+
+@main_bp.route("/stream/<string:event_id>/<path:filename>", methods=["GET"])
+def stream_hls(event_id: str, filename: str):
+    """Serves the HLS playlist and segments built at ingest."""
+    return send_from_directory(os.path.join(media.renditions_dir(event_id), "hls"), filename)
+
 @main_bp.route("/player/<string:event_id>.mp4")
 @main_bp.route("/player/<string:event_id>")
 def player_page(event_id):
-    # renders a tiny HTML page whose only job is to play the video
-    return render_template("player.html", event_id=event_id)
+    # renders a tiny HTML page whose only job is to play the video,
+    # preferring the lightest rendition that exists for it
+    preview_url = None
+    hls_url = None
+    if os.path.exists(media.preview_path(event_id)):
+        preview_url = url_for("main.preview_video", event_id=event_id)
+    if os.path.exists(media.hls_playlist_path(event_id)):
+        hls_url = url_for("main.stream_hls", event_id=event_id, filename="index.m3u8")
+    return render_template("player.html", event_id=event_id, preview_url=preview_url, hls_url=hls_url)
+
+def _clip_filename(behavior):
+    description = "".join(c if c.isalnum() else "_" for c in behavior.behavior_description).strip("_")
+    return f"{behavior.event_id}_{behavior.id}_{description[:40]}.mp4"
+
+def _clip_range(start, end, duration):
+    """Clamps [start, end] to the video; returns (start, end, error message or None)."""
+    # NaN passes every comparison below, and float() accepts "nan" and "inf"
+    if not math.isfinite(start) or not math.isfinite(end):
+        return start, end, "start and end must be finite numbers"
+    start = max(start, 0.0)
+    end = min(end, duration)
+    if end <= start:
+        return start, end, "End time must be after start time"
+    if end - start > current_app.config["CLIP_MAX_SECONDS"]:
+        return start, end, "Clip is too long"
+    return start, end, None
+
+def _send_clip(event_id, start, end, download_name):
+    try:
+        clip = clips.get_clip(event_id, start, end)
+    except RuntimeError as e:
+        current_app.logger.error(f"Could not cut clip {start:.1f}-{end:.1f} of {event_id}: {e}")
+        return jsonify({"success": False, "error": "Could not cut the clip"}), 500
+    if clip is None:
+        abort(404)
+    return send_file(clip, mimetype="video/mp4", conditional=True, download_name=download_name)
+
+@main_bp.route("/clip/<string:event_id>.mp4", methods=["GET"])
+@admission('heavy')
+@replica_read
+def download_clip(event_id: str):
+    """Returns only [start, end] seconds of an event's video, cut without re-encoding."""
+    event = Event.lookup(event_id) or abort(404)
+    start = request.args.get("start", type=float)
+    end = request.args.get("end", type=float)
+    if start is None or end is None:
+        return jsonify({"success": False, "error": "start and end are required"}), 400
+
+    start, end, error = _clip_range(start, end, event.video_duration_seconds)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    return _send_clip(event.event_id, start, end, f"{event.event_id}_{start:.1f}-{end:.1f}.mp4")
+
+@main_bp.route("/clip/behavior/<int:behavior_id>.mp4", methods=["GET"])
+@admission('heavy')
+@replica_read
+def download_behavior_clip(behavior_id: int):
+    """Returns the part of the video covered by one behavior annotation."""
+    behavior = Behavior.query.get_or_404(behavior_id)
+    event = Event.lookup(behavior.event_id) or abort(404)
+    start, end, error = _clip_range(behavior.start_time_seconds, behavior.end_time_seconds,
+                                    event.video_duration_seconds)
+    if error:
+        return jsonify({"success": False, "error": error}), 400
+    return _send_clip(event.event_id, start, end, _clip_filename(behavior))
 
 @main_bp.route("/download/batch")
+@admission('heavy')
+@replica_read
 def download_batch():
     """
     Takes a comma-separated list of event_ids, creates a zip file
     of the corresponding videos, and sends it to the user.
+    With mode=behaviors, only the annotated behavior clips are included.
     """
     event_ids_str = request.args.get("ids")
     if not event_ids_str:
         return "No event IDs provided", 400
 
     event_ids = event_ids_str.split(',')
+    mode = request.args.get("mode", "videos", type=str)
 
     # Use an in-memory file for the zip archive
     memory_file = io.BytesIO()
 
+    store = get_store()
     with zipfile.ZipFile(memory_file, 'w', zipfile.ZIP_DEFLATED) as zf:
-        for event_id in event_ids:
-            event = Event.query.get(event_id)
-            if event:
-                video_path = os.path.join(current_app.config["WATCH_FOLDER"], f"{event.event_id}.mp4")
-                if os.path.exists(video_path):
-                    # Add the file to the zip, using the event_id as the filename
-                    zf.write(video_path, arcname=f"{event.event_id}.mp4")
-
+        if mode == "behaviors":
+            rows = (db.session.query(Behavior, Event.video_duration_seconds)
+                    .join(Event, Event.event_id == Behavior.event_id)
+                    .filter(Behavior.event_id.in_(event_ids))
+                    .order_by(Behavior.event_id, Behavior.start_time_seconds).all())
+            for behavior, duration in rows:
+                start, end, error = _clip_range(behavior.start_time_seconds, behavior.end_time_seconds, duration)
+                if error:
+                    current_app.logger.warning(f"Skipping clip for behavior {behavior.id}: {error}")
+                    continue
+                try:
+                    clip = clips.get_clip(behavior.event_id, start, end, evict_cache=False)
+                except RuntimeError as e:
+                    current_app.logger.error(f"Could not cut clip for behavior {behavior.id}: {e}")
+                    continue
+                if clip is not None:
+                    # MP4 is already compressed, so store it as is
+                    zf.write(clip, arcname=_clip_filename(behavior), compress_type=zipfile.ZIP_STORED)
+        else:
+            for event_id in event_ids:
+                event = Event.lookup(event_id)
+                if event:
+                    video_path = retention.restore_video(event.event_id, store)
+                    if video_path is not None:
+                        # Add the file to the zip, using the event_id as the filename
+                        zf.write(video_path, arcname=f"{event.event_id}.mp4")
+
+    if mode == "behaviors":
+        # Once per batch; the clips are already in the zip
+        clips.evict(current_app.config["CLIP_CACHE_MAX_BYTES"])
     memory_file.seek(0)
 
     return send_file(
         memory_file,
         mimetype='application/zip',
         as_attachment=True,
-        download_name='videos.zip'
+        download_name='behavior_clips.zip' if mode == "behaviors" else 'videos.zip'
     )
 
+def _upload_error(e):
+    body = {"success": False, "error": str(e)}
+    if e.offset is not None:
+        body["offset"] = e.offset
+    response = jsonify(body)
+    if e.offset is not None:
+        response.headers["Upload-Offset"] = str(e.offset)
+    return response, e.status
+
+@main_bp.route("/api/uploads", methods=["POST"])
+@device_token_required
+def create_upload():
+    """Starts a resumable upload for an event's video or detection JSON."""
+    data = request.get_json(silent=True) or {}
+    try:
+        upload = resumable.create_session(
+            data.get("event_id"), data.get("kind", "video"), data.get("size"), data.get("sha256")
+        )
+    except resumable.UploadError as e:
+        return _upload_error(e)
+
+    location = url_for("main.upload_chunk", upload_id=upload["upload_id"])
+    response = jsonify({"success": True, "upload_id": upload["upload_id"], "offset": 0, "location": location})
+    response.headers["Location"] = location
+    return response, 201
+
+@main_bp.route("/api/uploads/<string:upload_id>", methods=["PUT"])
+@device_token_required
+def upload_chunk(upload_id: str):
+    """Appends the byte range given in Content-Range, streaming the body to disk."""
+    try:
+        offset = resumable.write_chunk(upload_id, request.headers.get("Content-Range"), request.stream)
+    except resumable.UploadError as e:
+        return _upload_error(e)
+
+    response = jsonify({"success": True, "offset": offset})
+    response.headers["Upload-Offset"] = str(offset)
+    return response
+
+@main_bp.route("/api/uploads/<string:upload_id>", methods=["GET"])
+@device_token_required
+def upload_status(upload_id: str):
+    """Reports how many bytes have been received, so a client can resume."""
+    try:
+        upload = resumable.load_session(upload_id)
+    except resumable.UploadError as e:
+        return _upload_error(e)
+
+    offset = upload["size"] if upload.get("completed") else resumable.current_offset(upload_id)
+    response = jsonify({"success": True, "offset": offset, "size": upload["size"],
+                        "completed": bool(upload.get("completed"))})
+    response.headers["Upload-Offset"] = str(offset)
+    return response
+
+@main_bp.route("/api/uploads/<string:upload_id>/finalize", methods=["POST"])
+@device_token_required
+def finalize_upload(upload_id: str):
+    """Verifies the sha256 and moves the file into the WATCH_FOLDER."""
+    try:
+        upload, _ = resumable.finalize(upload_id)
+    except resumable.UploadError as e:
+        return _upload_error(e)
+
+    ingest_in_background(upload["event_id"])
+    return jsonify({"success": True, "event_id": upload["event_id"], "kind": upload["kind"]})
+
+@main_bp.route('/api/similar/<string:event_id>', methods=['GET'])
+@admission('medium')
+@replica_read
+def similar_events(event_id: str):
+    """Top-k events with the closest signatures (species mix, counts, time of day, duration, confidence)."""
+    k = min(max(request.args.get('k', 10, type=int), 1), 100)
+    neighbours = similarity.nearest(event_id, k=k)
+    if not neighbours and not Event.lookup(event_id):
+        return jsonify({"success": False, "error": "Event not found"}), 404
+
+    events = {
+        event.event_id: event
+        for event in Event.query.filter(Event.event_id.in_([n[0] for n in neighbours])).all()
+    }
+    results = [
+        {
+            'event_id': neighbour_id,
+            'distance': round(distance, 4),
+            'device_id': events[neighbour_id].device_id,
+            'timestamp_start_utc': events[neighbour_id].timestamp_start_utc.isoformat(),
+            'primary_species': events[neighbour_id].primary_species,
+        }
+        for neighbour_id, distance in neighbours if neighbour_id in events
+    ]
+    return jsonify({"success": True, "event_id": event_id, "similar": results})
+
 @main_bp.route('/api/class_distribution', methods=['GET'])
+@admission('medium')
+@replica_read
 def class_distribution_data():
     """
     This endpoint provides data for the detected class distribution chart.
@@ -396,7 +637,7 @@ def class_distribution_data():
     counts = db.session.query(
         unnested_classes,
         func.count()
-    ).group_by(unnested_classes).all()
+    ).select_from(Detection).join(Event, Event.event_id == Detection.event_id).group_by(unnested_classes).all()
 
     chart_data = {
         'labels': [item[0] for item in counts],
@@ -410,24 +651,171 @@ def dashboard():
     """Renders the main dashboard page."""
     return render_template('dashboard.html')
 
+@main_bp.route('/api/admission/metrics')
+@admin_required
+def admission_metrics():
+    """Admission-control counters, latency histogram and current load per cost class, across all workers."""
+    return jsonify({"success": True, "classes": admission_control.snapshot()})
+
+# Bucket sizes for the events-over-time chart, finest first, with their approximate length
+TIME_BUCKETS = [
+    ('hour', timedelta(hours=1)),
+    ('day', timedelta(days=1)),
+    ('week', timedelta(weeks=1)),
+    ('month', timedelta(days=30.44)),
+]
+
+def _downsample(x, series, max_points):
+    """Merges consecutive buckets (summing counts) until at most max_points remain."""
+    if len(x) <= max_points:
+        return x, series
+    stride = -(-len(x) // max_points)
+    x = x[::stride]
+    series = {
+        name: [sum(values[i:i + stride]) for i in range(0, len(values), stride)]
+        for name, values in series.items()
+    }
+    return x, series
+
 @main_bp.route('/api/detections_over_time')
+@admission('medium')
+@replica_read
 def detections_over_time_data():
-    day_expression = func.date(Event.timestamp_start_utc).label("day")
-
-    counts = db.session.query(
-        day_expression,
-        func.count(Event.event_id)
-    ).group_by(day_expression).order_by(day_expression).all()
+    """
+    Event counts per time bucket, optionally restricted to a date range and
+    split into one series per class or device. The bucket is coarsened
+    automatically so the response never exceeds max_points buckets.
+    """
+    start_str = request.args.get('start', type=str)
+    end_str = request.args.get('end', type=str)
+    bucket = request.args.get('bucket', 'day', type=str)
+    group_by = request.args.get('group_by', '', type=str)
+    max_points = min(max(request.args.get('max_points', 500, type=int), 10), 5000)
+    max_series = min(max(request.args.get('max_series', 10, type=int), 1), 50)
+
+    bucket_names = [name for name, _ in TIME_BUCKETS]
+    if bucket not in bucket_names:
+        return jsonify({"error": f"bucket must be one of {', '.join(bucket_names)}"}), 400
+    if group_by not in ('', 'class', 'device'):
+        return jsonify({"error": "group_by must be 'class' or 'device'"}), 400
 
-    # Using 'x' and 'y' is more conventional for Plotly line charts
+    try:
+        start = datetime.strptime(start_str, '%Y-%m-%d') if start_str else None
+        end = datetime.strptime(end_str, '%Y-%m-%d') + timedelta(days=1) if end_str else None
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+
+    filters = []
+    if start:
+        filters.append(Event.timestamp_start_utc >= start)
+    if end:
+        filters.append(Event.timestamp_start_utc < end)
+
+    # Coarsen the bucket until the requested range fits in max_points
+    first, last = db.session.query(
+        func.min(Event.timestamp_start_utc), func.max(Event.timestamp_start_utc)
+    ).filter(*filters).one()
+    if first is None:
+        return jsonify({'bucket': bucket, 'x': [], 'y': [], 'series': []})
+    span = (end or last) - (start or first)
+    bucket_index = bucket_names.index(bucket)
+    while bucket_index < len(TIME_BUCKETS) - 1 and span / TIME_BUCKETS[bucket_index][1] > max_points:
+        bucket_index += 1
+    bucket = bucket_names[bucket_index]
+
+    # The bucket name is inlined (it is whitelisted above) so GROUP BY matches the SELECT expression
+    bucket_expression = func.date_trunc(db.literal_column(f"'{bucket}'"), Event.timestamp_start_utc).label("bucket")
+    if group_by == 'class':
+        classes = func.unnest(
+            func.coalesce(Detection.classes_modified, Detection.classes_detected)
+        ).table_valued("class_name").lateral()
+        group_expression = classes.c.class_name
+        q = db.session.query(bucket_expression, group_expression, func.count()).select_from(Event).join(Detection, Detection.event_id == Event.event_id).join(classes, db.true())
+    elif group_by == 'device':
+        group_expression = Event.device_id.label("series")
+        q = db.session.query(bucket_expression, group_expression, func.count(Event.event_id))
+    else:
+        group_expression = None
+        q = db.session.query(bucket_expression, func.count(Event.event_id))
+
+    q = q.filter(*filters)
+    if group_expression is not None:
+        rows = q.group_by(bucket_expression, group_expression).order_by(bucket_expression).all()
+    else:
+        rows = [(b, None, count) for b, count in q.group_by(bucket_expression).order_by(bucket_expression).all()]
+
+    buckets = sorted({row[0] for row in rows})
+    bucket_to_idx = {b: i for i, b in enumerate(buckets)}
+    series = defaultdict(lambda: [0] * len(buckets))
+    for b, name, count in rows:
+        series[name][bucket_to_idx[b]] += count
+
+    # Keep the largest series and fold the rest into "Other"
+    if group_expression is not None and len(series) > max_series:
+        ranked = sorted(series, key=lambda name: sum(series[name]), reverse=True)
+        other = [0] * len(buckets)
+        for name in ranked[max_series:]:
+            other = [a + b for a, b in zip(other, series.pop(name))]
+        series['Other'] = other
+
+    label_format = '%Y-%m-%d %H:00' if bucket == 'hour' else '%Y-%m-%d'
+    x, series = _downsample([b.strftime(label_format) for b in buckets], dict(series), max_points)
+
+    # 'x'/'y' keep the original ungrouped shape; for grouped requests 'y' is the sum of the series
+    totals = [sum(values) for values in zip(*series.values())] if series else []
     chart_data = {
-        'x': [item[0].strftime('%Y-%m-%d') for item in counts],
-        'y': [item[1] for item in counts]
+        'bucket': bucket,
+        'x': x,
+        'y': totals,
+        'series': [{'name': name, 'y': values} for name, values in series.items()] if group_expression is not None else []
     }
-    
+
     return jsonify(chart_data)
 
+@main_bp.route('/api/occupancy')
+@admission('medium')
+@replica_read
+def occupancy_data():
+    """
+    Where in a device's frame a class appears: the sum of the pre-bucketed
+    monthly occupancy grids, optionally limited to a date range.
+    """
+    device_id = request.args.get('device_id', type=str)
+    class_name = request.args.get('class_name', type=str)
+    start_str = request.args.get('start', type=str)
+    end_str = request.args.get('end', type=str)
+    if not device_id:
+        return jsonify({"error": "device_id is required"}), 400
+
+    try:
+        # Grids are stored per month, so the range is widened to whole months
+        start_month = datetime.strptime(start_str, '%Y-%m-%d').date().replace(day=1) if start_str else None
+        end_month = datetime.strptime(end_str, '%Y-%m-%d').date().replace(day=1) if end_str else None
+    except ValueError:
+        return jsonify({"error": "start and end must be dates in YYYY-MM-DD format"}), 400
+
+    grid, event_count = occupancy.query_grid(device_id, class_name, start_month, end_month)
+    return jsonify({
+        'device_id': device_id,
+        'class_name': class_name,
+        'event_count': event_count,
+        'z': grid.tolist()
+    })
+
+@main_bp.route('/api/occupancy/options')
+@replica_read
+def occupancy_options():
+    """Devices and classes that have occupancy grids, for the dashboard selectors."""
+    devices = db.session.query(OccupancyGrid.device_id).distinct().order_by(OccupancyGrid.device_id).all()
+    classes = db.session.query(OccupancyGrid.class_name).distinct().order_by(OccupancyGrid.class_name).all()
+    return jsonify({
+        'devices': [row[0] for row in devices],
+        'classes': [row[0] for row in classes]
+    })
+
 @main_bp.route('/api/class_cooccurrence')
+@admission('heavy')
+@replica_read
 def class_cooccurrence_data():
     """
     Provides data for the class co-occurrence heatmap.
@@ -437,7 +825,7 @@ def class_cooccurrence_data():
     # We only care about events where there's more than one class detected.
     query = db.session.query(
         func.coalesce(Detection.classes_modified, Detection.classes_detected)
-    ).filter(
+    ).join(Event, Event.event_id == Detection.event_id).filter(
         func.array_length(
             func.coalesce(Detection.classes_modified, Detection.classes_detected), 1
         ) > 1
@@ -30,4 +30,101 @@ class Config:
     WATCH_FOLDER = os.environ.get(
         "WATCH_FOLDER",
         os.path.join(UPLOAD_FOLDER, "incoming")
-    )
\ No newline at end of file
+    )
+
+    # Ingest-time media processing
+    FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY")
+    FFPROBE_BINARY = os.environ.get("FFPROBE_BINARY")
+    RENDITIONS_FOLDER = os.environ.get(
+        "RENDITIONS_FOLDER",
+        os.path.join(UPLOAD_FOLDER, "renditions")
+    )
+    MEDIA_FASTSTART = os.environ.get("MEDIA_FASTSTART", "true").lower() == "true"
+    MEDIA_HLS_ENABLED = os.environ.get("MEDIA_HLS_ENABLED", "false").lower() == "true"
+    MEDIA_PREVIEW_ENABLED = os.environ.get("MEDIA_PREVIEW_ENABLED", "false").lower() == "true"
+    HLS_SEGMENT_SECONDS = int(os.environ.get("HLS_SEGMENT_SECONDS", 4))
+    PREVIEW_HEIGHT = int(os.environ.get("PREVIEW_HEIGHT", 360))
+    PREVIEW_BITRATE = os.environ.get("PREVIEW_BITRATE", "400k")
+
+    # Pull-based SFTP ingestion from edge devices
+    SFTP_DEVICES_FILE = os.environ.get(
+        "SFTP_DEVICES_FILE",
+        os.path.join(basedir, "sftp_devices.json")
+    )
+    SFTP_CONNECTIONS_PER_DEVICE = int(os.environ.get("SFTP_CONNECTIONS_PER_DEVICE", 2))
+    SFTP_WORKERS = int(os.environ.get("SFTP_WORKERS", 8))
+    SFTP_CHUNK_SIZE = int(os.environ.get("SFTP_CHUNK_SIZE", 1024 * 1024))
+    SFTP_MAX_REQUESTS = int(os.environ.get("SFTP_MAX_REQUESTS", 64))
+
+    # Resumable chunked uploads from edge devices
+    EDGE_API_TOKENS = [t for t in os.environ.get("EDGE_API_TOKENS", "").split(",") if t]
+    UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+    UPLOAD_SESSION_TTL_HOURS = int(os.environ.get("UPLOAD_SESSION_TTL_HOURS", 72))
+
+    # On-disk layout of videos and detection JSON under WATCH_FOLDER
+    STORAGE_SHARDED = os.environ.get("STORAGE_SHARDED", "true").lower() == "true"
+    STORAGE_DEDUP = os.environ.get("STORAGE_DEDUP", "false").lower() == "true"
+
+    # Similar-event search
+    SIGNATURE_FOLDER = os.environ.get(
+        "SIGNATURE_FOLDER",
+        os.path.join(UPLOAD_FOLDER, "signatures")
+    )
+    SIMILARITY_BATCH_ROWS = int(os.environ.get("SIMILARITY_BATCH_ROWS", 65536))
+    SIMILAR_SEARCH_K = int(os.environ.get("SIMILAR_SEARCH_K", 100))
+
+    # Behavior clip extraction
+    CLIP_CACHE_FOLDER = os.environ.get(
+        "CLIP_CACHE_FOLDER",
+        os.path.join(UPLOAD_FOLDER, "clips")
+    )
+    CLIP_CACHE_MAX_BYTES = int(os.environ.get("CLIP_CACHE_MAX_BYTES", 5 * 1024 * 1024 * 1024))
+    CLIP_MAX_SECONDS = float(os.environ.get("CLIP_MAX_SECONDS", 600))
+
+    # Optional streaming read replica for search and dashboard queries
+    SQLALCHEMY_DATABASE_REPLICA_URL = os.environ.get("DATABASE_REPLICA_URL")
+    # A hung replica must fail fast so reads fall back to the primary
+    REPLICA_CONNECT_TIMEOUT_SECONDS = int(os.environ.get("REPLICA_CONNECT_TIMEOUT_SECONDS", 2))
+    REPLICA_STATEMENT_TIMEOUT_SECONDS = int(os.environ.get("REPLICA_STATEMENT_TIMEOUT_SECONDS", 60))
+    SQLALCHEMY_BINDS = {
+        "replica": {
+            "url": SQLALCHEMY_DATABASE_REPLICA_URL,
+            "connect_args": {
+                "connect_timeout": REPLICA_CONNECT_TIMEOUT_SECONDS,
+                "options": f"-c statement_timeout={REPLICA_STATEMENT_TIMEOUT_SECONDS * 1000}",
+            },
+        }
+    } if SQLALCHEMY_DATABASE_REPLICA_URL else {}
+    REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", 10))
+    REPLICA_HEALTH_CHECK_SECONDS = float(os.environ.get("REPLICA_HEALTH_CHECK_SECONDS", 5))
+
+    # Retention: videos and detection JSON older than these many days move to the cold tier (0 keeps them hot)
+    COLD_STORAGE_FOLDER = os.environ.get(
+        "COLD_STORAGE_FOLDER",
+        os.path.join(UPLOAD_FOLDER, "cold")
+    )
+    RETENTION_POLICIES_FILE = os.environ.get(
+        "RETENTION_POLICIES_FILE",
+        os.path.join(basedir, "retention_policies.json")
+    )
+    RETENTION_VIDEO_DAYS = int(os.environ.get("RETENTION_VIDEO_DAYS", 0))
+    RETENTION_JSON_DAYS = int(os.environ.get("RETENTION_JSON_DAYS", 0))
+    RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 100))
+    RETENTION_BATCH_PAUSE_SECONDS = float(os.environ.get("RETENTION_BATCH_PAUSE_SECONDS", 1.0))
+
+    # Admission control: concurrent requests allowed per cost class, across all workers (0 = unlimited)
+    ADMISSION_FOLDER = os.environ.get(
+        "ADMISSION_FOLDER",
+        os.path.join(UPLOAD_FOLDER, "admission")
+    )
+    ADMISSION_HEAVY_GLOBAL = int(os.environ.get("ADMISSION_HEAVY_GLOBAL", 2))
+    ADMISSION_HEAVY_PER_USER = int(os.environ.get("ADMISSION_HEAVY_PER_USER", 1))
+    ADMISSION_MEDIUM_GLOBAL = int(os.environ.get("ADMISSION_MEDIUM_GLOBAL", 3))
+    # The dashboard loads three medium charts at once
+    ADMISSION_MEDIUM_PER_USER = int(os.environ.get("ADMISSION_MEDIUM_PER_USER", 3))
+    # Requests allowed to wait for a slot at any moment, shared by every class
+    ADMISSION_MAX_WAITING = int(os.environ.get("ADMISSION_MAX_WAITING", 1))
+    ADMISSION_WAIT_SECONDS = float(os.environ.get("ADMISSION_WAIT_SECONDS", 3))
+    # Threads of one worker that limited requests may occupy, running or waiting; keep below --threads
+    ADMISSION_WORKER_SLOTS = int(os.environ.get("ADMISSION_WORKER_SLOTS", 3))
+    ADMISSION_METRICS_FLUSH_SECONDS = float(os.environ.get("ADMISSION_METRICS_FLUSH_SECONDS", 10))
@@ -0,0 +1,42 @@
+"""Add event_class_stats table
+
+Revision ID: c3a81f5e2d94
+Revises: 4b5992def7cc
+Create Date: 2026-10-19 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3a81f5e2d94'
+down_revision = '4b5992def7cc'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('event_class_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('class_name', sa.String(length=64), nullable=False),
+    sa.Column('max_count', sa.Integer(), nullable=False),
+    sa.Column('frames_present', sa.Integer(), nullable=False),
+    sa.Column('dwell_seconds', sa.Float(), nullable=False),
+    sa.Column('mean_confidence', sa.Float(), nullable=False),
+    sa.ForeignKeyConstraint(['event_id'], ['events.event_id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('event_id', 'class_name', name='uq_event_class_stats_event_class')
+    )
+    op.create_index('ix_event_class_stats_class_max_count', 'event_class_stats',
+                    [sa.text('lower(class_name)'), 'max_count'], unique=False)
+    op.create_index('ix_event_class_stats_class_dwell', 'event_class_stats',
+                    [sa.text('lower(class_name)'), 'dwell_seconds'], unique=False)
+    # Existing events are backfilled with `flask ingest`
+
+
+def downgrade():
+    op.drop_index('ix_event_class_stats_class_dwell', table_name='event_class_stats')
+    op.drop_index('ix_event_class_stats_class_max_count', table_name='event_class_stats')
+    op.drop_table('event_class_stats')
@@ -0,0 +1,176 @@
+"""Partition events by month
+
+Revision ID: e1f7a3c9b204
+Revises: 9d4e2b6a7f10
+Create Date: 2026-10-19 16:02:37.418203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f7a3c9b204'
+down_revision = '9d4e2b6a7f10'
+branch_labels = None
+depends_on = None
+
+CHILD_TABLES = ('detections', 'behaviors', 'event_class_stats', 'occupancy_events')
+MONTHS_AHEAD = 3
+
+EVENT_COLUMNS = (
+    'event_id, device_id, timestamp_start_utc, timestamp_end_utc, video_duration_seconds, '
+    'primary_species, status, remote_video_path, remote_json_path'
+)
+
+# Creates the partition for one month. Rows that already landed in the
+# default partition for that month are moved into the new partition.
+CREATE_PARTITION_FUNCTION = """
+CREATE OR REPLACE FUNCTION events_create_partition(month date) RETURNS text AS $$
+DECLARE
+    start_ts timestamp := date_trunc('month', month);
+    end_ts timestamp := date_trunc('month', month) + interval '1 month';
+    part text := format('events_y%sm%s', to_char(start_ts, 'YYYY'), to_char(start_ts, 'MM'));
+BEGIN
+    IF to_regclass(part) IS NOT NULL THEN
+        RETURN part;
+    END IF;
+    IF to_regclass('events_default') IS NOT NULL AND EXISTS (
+        SELECT 1 FROM events_default WHERE timestamp_start_utc >= start_ts AND timestamp_start_utc < end_ts
+    ) THEN
+        ALTER TABLE events DETACH PARTITION events_default;
+        EXECUTE format('CREATE TABLE %I (LIKE events INCLUDING DEFAULTS INCLUDING CONSTRAINTS)', part);
+        EXECUTE format(
+            'INSERT INTO %I SELECT * FROM events_default WHERE timestamp_start_utc >= %L AND timestamp_start_utc < %L',
+            part, start_ts, end_ts);
+        EXECUTE format('ALTER TABLE events ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)', part, start_ts, end_ts);
+        DELETE FROM events_default WHERE timestamp_start_utc >= start_ts AND timestamp_start_utc < end_ts;
+        ALTER TABLE events ATTACH PARTITION events_default DEFAULT;
+    ELSE
+        EXECUTE format('CREATE TABLE %I PARTITION OF events FOR VALUES FROM (%L) TO (%L)', part, start_ts, end_ts);
+    END IF;
+    RETURN part;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+# Keeps event_locator in step with events. Moving a row to another partition
+# runs as a DELETE plus an INSERT, so a delete only drops the locator row
+# (and, through the foreign keys, the child rows) once the event is gone.
+LOCATOR_SYNC_FUNCTION = """
+CREATE OR REPLACE FUNCTION event_locator_sync() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        IF NOT EXISTS (SELECT 1 FROM events WHERE event_id = OLD.event_id) THEN
+            DELETE FROM event_locator WHERE event_id = OLD.event_id;
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP = 'INSERT' AND EXISTS (
+        SELECT 1 FROM event_locator l
+        JOIN events e ON e.event_id = l.event_id AND e.timestamp_start_utc = l.timestamp_start_utc
+        WHERE l.event_id = NEW.event_id AND l.timestamp_start_utc <> NEW.timestamp_start_utc
+    ) THEN
+        RAISE EXCEPTION 'duplicate key value violates unique constraint "event_locator_pkey"'
+            USING ERRCODE = 'unique_violation', DETAIL = format('Key (event_id)=(%s) already exists.', NEW.event_id);
+    END IF;
+
+    INSERT INTO event_locator (event_id, timestamp_start_utc)
+    VALUES (NEW.event_id, NEW.timestamp_start_utc)
+    ON CONFLICT (event_id) DO UPDATE SET timestamp_start_utc = EXCLUDED.timestamp_start_utc;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+"""
+
+
+def upgrade():
+    for table in CHILD_TABLES:
+        op.drop_constraint(f'{table}_event_id_fkey', table, type_='foreignkey')
+
+    op.execute('ALTER TABLE events RENAME TO events_unpartitioned')
+    op.execute('ALTER INDEX events_pkey RENAME TO events_unpartitioned_pkey')
+    op.drop_index('ix_events_timestamp_start_utc', table_name='events_unpartitioned')
+
+    op.create_table('events',
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('device_id', sa.String(length=64), nullable=False),
+    sa.Column('timestamp_start_utc', sa.DateTime(), nullable=False),
+    sa.Column('timestamp_end_utc', sa.DateTime(), nullable=False),
+    sa.Column('video_duration_seconds', sa.Float(), nullable=False),
+    sa.Column('primary_species', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('remote_video_path', sa.String(length=256), nullable=True),
+    sa.Column('remote_json_path', sa.String(length=256), nullable=True),
+    sa.PrimaryKeyConstraint('event_id', 'timestamp_start_utc'),
+    postgresql_partition_by='RANGE (timestamp_start_utc)'
+    )
+    op.create_index(op.f('ix_events_timestamp_start_utc'), 'events', ['timestamp_start_utc'], unique=False)
+    op.create_table('event_locator',
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('timestamp_start_utc', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+
+    # One partition per month from the oldest event up to a few months ahead, then a catch-all
+    op.execute(CREATE_PARTITION_FUNCTION)
+    op.execute(f"""
+        SELECT events_create_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', LEAST(now()::timestamp,
+                COALESCE((SELECT min(timestamp_start_utc) FROM events_unpartitioned), now()::timestamp))),
+            date_trunc('month', GREATEST(now()::timestamp + interval '{MONTHS_AHEAD} months',
+                COALESCE((SELECT max(timestamp_start_utc) FROM events_unpartitioned), now()::timestamp))),
+            interval '1 month'
+        ) AS month
+    """)
+    op.execute('CREATE TABLE events_default PARTITION OF events DEFAULT')
+
+    op.execute(f'INSERT INTO events ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM events_unpartitioned')
+    op.execute('INSERT INTO event_locator (event_id, timestamp_start_utc) '
+               'SELECT event_id, timestamp_start_utc FROM events_unpartitioned')
+    op.drop_table('events_unpartitioned')
+
+    op.execute(LOCATOR_SYNC_FUNCTION)
+    op.execute('CREATE TRIGGER events_locator_sync '
+               'AFTER INSERT OR UPDATE OF timestamp_start_utc OR DELETE ON events '
+               'FOR EACH ROW EXECUTE FUNCTION event_locator_sync()')
+
+    for table in CHILD_TABLES:
+        op.create_foreign_key(f'{table}_event_id_fkey', table, 'event_locator',
+                              ['event_id'], ['event_id'], ondelete='CASCADE')
+
+
+def downgrade():
+    for table in CHILD_TABLES:
+        op.drop_constraint(f'{table}_event_id_fkey', table, type_='foreignkey')
+
+    op.create_table('events_unpartitioned',
+    sa.Column('event_id', sa.String(length=64), nullable=False),
+    sa.Column('device_id', sa.String(length=64), nullable=False),
+    sa.Column('timestamp_start_utc', sa.DateTime(), nullable=False),
+    sa.Column('timestamp_end_utc', sa.DateTime(), nullable=False),
+    sa.Column('video_duration_seconds', sa.Float(), nullable=False),
+    sa.Column('primary_species', sa.String(length=64), nullable=False),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('remote_video_path', sa.String(length=256), nullable=True),
+    sa.Column('remote_json_path', sa.String(length=256), nullable=True),
+    sa.PrimaryKeyConstraint('event_id', name='events_unpartitioned_pkey')
+    )
+    op.execute(f'INSERT INTO events_unpartitioned ({EVENT_COLUMNS}) SELECT {EVENT_COLUMNS} FROM events')
+
+    op.execute('DROP TRIGGER events_locator_sync ON events')
+    op.execute('DROP FUNCTION event_locator_sync()')
+    op.drop_index(op.f('ix_events_timestamp_start_utc'), table_name='events')
+    # Dropping the partitioned table drops its partitions with it
+    op.drop_table('events')
+    op.execute('DROP FUNCTION events_create_partition(date)')
+    op.drop_table('event_locator')
+
+    op.execute('ALTER TABLE events_unpartitioned RENAME TO events')
+    op.execute('ALTER INDEX events_unpartitioned_pkey RENAME TO events_pkey')
+    op.create_index(op.f('ix_events_timestamp_start_utc'), 'events', ['timestamp_start_utc'], unique=False)
+    for table in CHILD_TABLES:
+        op.create_foreign_key(f'{table}_event_id_fkey', table, 'events',
+                              ['event_id'], ['event_id'], ondelete='CASCADE')